@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-batching of concurrent dictionary lookups.
+"""
+
+import asyncio
+from functools import partial
+from typing import Any, Optional
+
+import anyio
+
+# Flush a batch once it holds this many words...
+MAX_BATCH = 32
+# ...or once the first word has waited this long (seconds)
+MAX_WAIT = 0.002
+
+
+class LookupBatcher:
+    """
+    Coalesce lookups arriving within a short window into one
+    ``mdx_lookup_batch`` call, then fan the results back out to the waiting
+    requests. One batcher serves one (dictionary, ignorecase) pair.
+    """
+
+    def __init__(
+        self, ignorecase: bool, max_batch: int = MAX_BATCH, max_wait: float = MAX_WAIT
+    ):
+        self._ignorecase = ignorecase
+        self._max_batch = max_batch
+        self._max_wait = max_wait
+        self._builder: Any = None
+        self._pending: list[tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set[asyncio.Task] = set()
+
+    async def lookup(self, builder: Any, word: str) -> list[str]:
+        """Queue a word for the next batch and wait for its definitions."""
+        loop = asyncio.get_running_loop()
+        if self._pending and builder is not self._builder:
+            # The dictionary was reloaded, don't mix builders in one batch
+            self._flush()
+        self._builder = builder
+
+        future = loop.create_future()
+        self._pending.append((word, future))
+        if len(self._pending) >= self._max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self._max_wait, self._flush)
+        return await future
+
+    def drain(self) -> list[asyncio.Task]:
+        """
+        Send any queued words now and return the batches still in flight.
+        Must be called on the event loop the batcher runs on.
+        """
+        if self._pending:
+            self._flush()
+        return list(self._tasks)
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.get_running_loop().create_task(self._run(self._builder, batch))
+        # Only the running batch needs the builder, don't keep an evicted one alive
+        self._builder = None
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, builder: Any, batch: list[tuple[str, asyncio.Future]]) -> None:
+        words = [word for word, _ in batch]
+        try:
+            # Lookups do blocking SQLite and file I/O, keep them off the event loop
+            if len(words) == 1:
+                results = [
+                    await anyio.to_thread.run_sync(
+                        partial(builder.mdx_lookup, words[0], ignorecase=self._ignorecase)
+                    )
+                ]
+            else:
+                results = await anyio.to_thread.run_sync(
+                    partial(builder.mdx_lookup_batch, words, ignorecase=self._ignorecase)
+                )
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, future), definitions in zip(batch, results):
+                if not future.done():
+                    future.set_result(definitions)
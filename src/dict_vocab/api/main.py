@@ -3,71 +3,236 @@
 FastAPI application for dictionary lookup.
 """
 
+import errno
+import functools
+import logging
 import os
+import stat
+import threading
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Optional
+from typing import AsyncIterator, Optional
 
+import anyio
 from fastapi import FastAPI, HTTPException
-from fastapi.responses import FileResponse
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
+from starlette.datastructures import Headers
+from starlette.responses import Response, StreamingResponse
+from starlette.staticfiles import NotModifiedResponse
+from starlette.types import Scope
+
+from dict_vocab.api.batching import LookupBatcher
+from dict_vocab.api.cache import LRUCache, TTLCache
+from dict_vocab.api.responses import (
+    ORJSONResponse,
+    ZeroCopyFileResponse,
+    json_bytes,
+)
+from dict_vocab.indexer.mdict_indexer import IndexBuilder, ascii_lower
+
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Load the default dictionary before serving requests, so the first lookup
+    doesn't pay for building the index and a broken dictionary fails startup.
+    """
+    dict_path = _current_dict_path()
+    if dict_path and os.path.exists(dict_path):
+        await anyio.to_thread.run_sync(get_dict_builder, dict_path)
+    yield
 
-from dict_vocab.indexer.mdict_indexer import IndexBuilder
 
 app = FastAPI(
     title="Dict Vocab API",
     description="Dictionary lookup API with SQLite optimization",
     version="0.1.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
+# Resolved once at import, these never change while the server runs
+_PROJECT_ROOT = Path(__file__).resolve().parents[3]
+_FALLBACK_RESOURCE_DIR = _PROJECT_ROOT / "resource"
+
 DEFAULT_DICT_PATH = os.environ.get(
     "DEFAULT_DICT_PATH",
-    str(
-        Path(__file__).parent.parent.parent.parent
-        / "resource"
-        / "cobuild2024"
-        / "cobuild2024.mdx"
-    ),
+    str(_FALLBACK_RESOURCE_DIR / "cobuild2024" / "cobuild2024.mdx"),
 )
 
-_dict_cache: dict[str, IndexBuilder] = {}
+
+def _release_builder(dict_path: str, builder: IndexBuilder) -> None:
+    """
+    Close an evicted or replaced builder, and drop the lookup batchers and
+    cached lookup results of its dictionary. Batches already running on the
+    builder finish first, it is closed once the last of them is done.
+    """
+    in_flight: set = set()
+    for ignorecase in (False, True):
+        batcher = _lookup_batchers.pop((dict_path, ignorecase), None)
+        if batcher is not None:
+            in_flight.update(batcher.drain())
+    for key in _lookup_cache.keys():
+        if key[0] == dict_path:
+            _lookup_cache.pop(key)
+
+    if not in_flight:
+        builder.close()
+        return
+
+    def batch_done(task) -> None:
+        in_flight.discard(task)
+        if not in_flight:
+            builder.close()
+
+    for task in list(in_flight):
+        task.add_done_callback(batch_done)
+
+
+# Loaded dictionaries keyed by dict_path, evicted builders release their files
+DICT_CACHE_SIZE = 8
+_dict_cache = LRUCache(maxsize=DICT_CACHE_SIZE, on_evict=_release_builder)
+_dict_cache_lock = threading.Lock()
+
+# Concurrent lookups are coalesced per (dict_path, ignorecase)
+_lookup_batchers: dict[tuple[str, bool], LookupBatcher] = {}
+
+# Recent lookup results keyed by (dict_path, normalized word, ignorecase)
+LOOKUP_CACHE_SIZE = 10_000
+_lookup_cache = LRUCache(maxsize=LOOKUP_CACHE_SIZE)
+
+# Streamed definitions are sent in pieces of at most this many bytes
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Dictionary resources only change when the dictionary is replaced
+RESOURCE_CACHE_CONTROL = "public, max-age=86400"
+
+# Short-lived os.path.exists results, so hot paths skip the stat(2) call
+_exists_cache = TTLCache(maxsize=128, ttl=5)
+_exists_cache_lock = threading.Lock()
+
+# Content types for dictionary resources, keyed by lowercase file suffix
+_MIME: dict[str, str] = {
+    ".css": "text/css",
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".gif": "image/gif",
+    ".bmp": "image/bmp",
+    ".webp": "image/webp",
+    ".mp3": "audio/mpeg",
+    ".wav": "audio/wav",
+    ".ogg": "audio/ogg",
+    ".m4a": "audio/mp4",
+    ".js": "application/javascript",
+    ".html": "text/html",
+}
+
+
+def _current_dict_path() -> str:
+    """Default dictionary path, read at runtime to support env var changes."""
+    return os.environ.get("DEFAULT_DICT_PATH", "") or DEFAULT_DICT_PATH
+
+
+@functools.lru_cache(maxsize=64)
+def _resolve_dict_dir(dict_path: str) -> Path:
+    """Resolved directory containing the dictionary file."""
+    return Path(dict_path).parent.resolve()
+
+
+@functools.lru_cache(maxsize=64)
+def _base_prefix(base_dir: Path) -> str:
+    """
+    Normalized prefix every file served from base_dir must start with.
+    Uses the same separators and case as the resolved request path, and
+    ends with a separator for accurate prefix matching.
+    """
+    base_str = os.path.normcase(os.path.realpath(base_dir))
+    if not base_str.endswith(os.sep):
+        base_str += os.sep
+    return base_str
+
+
+def _path_exists(path: str) -> bool:
+    """os.path.exists, memoized for a few seconds. Safe to call from any thread."""
+    with _exists_cache_lock:
+        exists = _exists_cache.get(path)
+    if exists is None:
+        exists = os.path.exists(path)
+        with _exists_cache_lock:
+            _exists_cache[path] = exists
+    return exists
+
+
+# Plain models without assignment validation or attribute loading, so
+# validation and serialization stay on pydantic-core's fast path
+_MODEL_CONFIG = ConfigDict(
+    extra="ignore",
+    validate_assignment=False,
+    arbitrary_types_allowed=False,
+    from_attributes=False,
+)
 
 
 class LookupRequest(BaseModel):
+    model_config = _MODEL_CONFIG
+
     word: str
     dict_path: Optional[str] = None
     ignorecase: bool = False
 
 
 class LookupResponse(BaseModel):
+    model_config = _MODEL_CONFIG
+
     word: str
     definitions: list[str]
     dict_title: Optional[str] = None
 
 
 class DictInfo(BaseModel):
+    model_config = _MODEL_CONFIG
+
     path: str
     title: str
     encoding: str
 
 
 def get_dict_builder(dict_path: str, force_rebuild: bool = False) -> IndexBuilder:
-    """Get or create IndexBuilder for given dict path."""
-    cache_key = f"{dict_path}:{force_rebuild}"
-
-    if cache_key not in _dict_cache:
-        if not os.path.exists(dict_path):
-            raise HTTPException(
-                status_code=404, detail=f"Dictionary not found: {dict_path}"
+    """
+    Get or create IndexBuilder for given dict path.
+    force_rebuild replaces a cached builder with one built from a fresh index.
+    """
+    with _dict_cache_lock:
+        builder = None if force_rebuild else _dict_cache.get(dict_path)
+        if builder is None:
+            if not os.path.exists(dict_path):
+                raise HTTPException(
+                    status_code=404, detail=f"Dictionary not found: {dict_path}"
+                )
+            builder = IndexBuilder(
+                fname=dict_path,
+                force_rebuild=force_rebuild,
+                sql_index=True,
+                check=False,
             )
-        _dict_cache[cache_key] = IndexBuilder(
-            fname=dict_path,
-            force_rebuild=force_rebuild,
-            sql_index=True,
-            check=False,
-        )
+            stale = _dict_cache.pop(dict_path)
+            if stale is not None:
+                _release_builder(dict_path, stale)
+            _dict_cache[dict_path] = builder
+
+    return builder
+
 
-    return _dict_cache[cache_key]
+def get_lookup_batcher(dict_path: str, ignorecase: bool) -> LookupBatcher:
+    """Get or create the LookupBatcher for given dict path."""
+    key = (dict_path, ignorecase)
+    if key not in _lookup_batchers:
+        _lookup_batchers[key] = LookupBatcher(ignorecase=ignorecase)
+    return _lookup_batchers[key]
 
 
 @app.get("/health")
@@ -84,10 +249,9 @@ async def list_dicts():
     """
     dicts = []
 
-    # Read at runtime to support environment variable changes
-    current_dict_path = os.environ.get("DEFAULT_DICT_PATH", "") or DEFAULT_DICT_PATH
+    current_dict_path = _current_dict_path()
 
-    if current_dict_path and os.path.exists(current_dict_path):
+    if current_dict_path and _path_exists(current_dict_path):
         builder = get_dict_builder(current_dict_path)
         dicts.append(
             DictInfo(
@@ -98,19 +262,9 @@ async def list_dicts():
     return dicts
 
 
-@app.post("/lookup", response_model=LookupResponse)
-async def lookup_word(request: LookupRequest):
-    """
-    Look up a word in the dictionary.
-
-    Request body:
-        word: The word to look up
-        dict_path: Optional path to dictionary (uses DEFAULT_DICT_PATH if not provided)
-        ignorecase: Whether to ignore case (default: False)
-    """
-    # Read at runtime to support environment variable changes
-    current_default = os.environ.get("DEFAULT_DICT_PATH", "") or DEFAULT_DICT_PATH
-    dict_path = request.dict_path or current_default
+async def _lookup(request: LookupRequest) -> tuple[IndexBuilder, list[str]]:
+    """Resolve the dictionary for a lookup request and fetch its definitions."""
+    dict_path = request.dict_path or _current_dict_path()
 
     if not dict_path:
         raise HTTPException(
@@ -118,7 +272,7 @@ async def lookup_word(request: LookupRequest):
             detail="No dictionary path provided. Set DEFAULT_DICT_PATH or provide dict_path in request.",
         )
 
-    if not os.path.exists(dict_path):
+    if not _path_exists(dict_path):
         raise HTTPException(
             status_code=404, detail=f"Dictionary not found: {dict_path}"
         )
@@ -130,99 +284,221 @@ async def lookup_word(request: LookupRequest):
             status_code=500, detail=f"Failed to load dictionary: {str(e)}"
         )
 
-    try:
-        definitions = builder.mdx_lookup(request.word, ignorecase=request.ignorecase)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Lookup failed: {str(e)}")
+    # Fold case like the SQLite lower() the lookup uses, which leaves non-ASCII alone
+    word_key = ascii_lower(request.word) if request.ignorecase else request.word
+    cache_key = (dict_path, word_key, request.ignorecase)
+    definitions = _lookup_cache.get(cache_key)
 
+    if definitions is None:
+        try:
+            batcher = get_lookup_batcher(dict_path, request.ignorecase)
+            definitions = await batcher.lookup(builder, request.word)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Lookup failed: {str(e)}")
+        # Results from a builder replaced meanwhile must not refill the cache
+        with _dict_cache_lock:
+            current = _dict_cache.get(dict_path) is builder
+        if current:
+            _lookup_cache[cache_key] = definitions
+
+    return builder, definitions
+
+
+@app.post(
+    "/lookup", response_model=LookupResponse, response_model_exclude_unset=True
+)
+async def lookup_word(request: LookupRequest):
+    """
+    Look up a word in the dictionary.
+
+    Request body:
+        word: The word to look up
+        dict_path: Optional path to dictionary (uses DEFAULT_DICT_PATH if not provided)
+        ignorecase: Whether to ignore case (default: False)
+    """
+    builder, definitions = await _lookup(request)
     return LookupResponse(
         word=request.word, definitions=definitions, dict_title=builder.title
     )
 
 
-@app.get("/resource/{path:path}")
-async def serve_resource(path: str):
-    """Serve dictionary resource files (CSS, images, audio, etc.)."""
-    import os.path
+async def _stream_lookup_response(
+    word: str, definitions: list[str], dict_title: Optional[str]
+) -> AsyncIterator[bytes]:
+    yield b'{"word":' + json_bytes(word) + b',"definitions":['
+    for i, definition in enumerate(definitions):
+        encoded = json_bytes(definition)
+        if i:
+            encoded = b"," + encoded
+        for start in range(0, len(encoded), STREAM_CHUNK_SIZE):
+            yield encoded[start : start + STREAM_CHUNK_SIZE]
+    yield b'],"dict_title":' + json_bytes(dict_title) + b"}"
+
+
+@app.post("/lookup/stream")
+async def lookup_word_stream(request: LookupRequest):
+    """
+    Look up a word like /lookup, but stream the JSON body one definition at
+    a time. Meant for entries whose definitions run to hundreds of KB.
+    """
+    builder, definitions = await _lookup(request)
+    return StreamingResponse(
+        _stream_lookup_response(request.word, definitions, builder.title),
+        media_type="application/json",
+    )
+
+
+@app.post("/cache/clear")
+async def clear_cache():
+    """Drop all cached lookup results."""
+    _lookup_cache.clear()
+    return {"status": "ok"}
+
 
-    dict_path = os.environ.get("DEFAULT_DICT_PATH", "") or DEFAULT_DICT_PATH
+def _resource_location(path: str) -> tuple[Optional[Path], str]:
+    """
+    Map a requested resource path to (base directory, path within it).
+    The base directory is None when no dictionary directory is available.
+    """
+    dict_path = _current_dict_path()
 
-    print(f"DEBUG: Requested resource: {path}")
-    print(
-        f"DEBUG: dict_path from env: {os.environ.get('DEFAULT_DICT_PATH', 'NOT SET')}"
+    logger.debug("Requested resource: %s", path)
+    logger.debug(
+        "dict_path from env: %s", os.environ.get("DEFAULT_DICT_PATH", "NOT SET")
     )
-    print(f"DEBUG: DEFAULT_DICT_PATH module: {DEFAULT_DICT_PATH}")
+    logger.debug("DEFAULT_DICT_PATH module: %s", DEFAULT_DICT_PATH)
 
     resource_base_dir = None
     resource_subpath = path
 
     if dict_path:
-        dict_dir = Path(dict_path).parent.resolve()
-        print(f"DEBUG: dict_dir: {dict_dir}")
-        print(f"DEBUG: dict_dir exists: {dict_dir.exists()}")
-        if dict_dir.exists():
+        dict_dir = _resolve_dict_dir(dict_path)
+        dict_dir_exists = _path_exists(str(dict_dir))
+        logger.debug("dict_dir: %s (exists: %s)", dict_dir, dict_dir_exists)
+        if dict_dir_exists:
             resource_base_dir = dict_dir
             # path is like "cobuild2024/cobuild2024.css", extract the subpath
             # dict_dir is already "resource/cobuild2024", so use path as-is
             # but we need to handle if path starts with dict name
             dict_name = dict_dir.name
-            if path.startswith(dict_name + "/"):
+            if path.startswith(dict_name + os.sep):
                 resource_subpath = path[len(dict_name) + 1 :]
 
     # Fallback: auto-detect resource directory from project root
     if resource_base_dir is None:
-        current_file = Path(__file__).resolve()
-        project_root = current_file.parent.parent.parent.parent
-        fallback_resource_dir = project_root / "resource"
-        print(f"DEBUG: fallback_resource_dir: {fallback_resource_dir}")
-        print(f"DEBUG: fallback exists: {fallback_resource_dir.exists()}")
-        if fallback_resource_dir.exists():
-            resource_base_dir = fallback_resource_dir
+        fallback_exists = _path_exists(str(_FALLBACK_RESOURCE_DIR))
+        logger.debug(
+            "fallback_resource_dir: %s (exists: %s)",
+            _FALLBACK_RESOURCE_DIR,
+            fallback_exists,
+        )
+        if fallback_exists:
+            resource_base_dir = _FALLBACK_RESOURCE_DIR
+
+    logger.debug("resource_base_dir: %s", resource_base_dir)
+    logger.debug("resource_subpath: %s", resource_subpath)
+
+    return resource_base_dir, resource_subpath
 
-    print(f"DEBUG: resource_base_dir: {resource_base_dir}")
-    print(f"DEBUG: resource_subpath: {resource_subpath}")
 
+def _stat_resource(
+    resource_base_dir: Optional[Path], resource_subpath: str
+) -> tuple[str, Optional[os.stat_result]]:
+    """
+    Resolve a resource inside resource_base_dir and stat it. Returns ("", None)
+    when there is no base directory, the file is missing, or the path escapes
+    the base directory.
+    """
     if resource_base_dir is None:
-        raise HTTPException(status_code=404, detail="No dictionary configured")
+        return "", None
 
     # Security check: prevent path traversal attacks
     # Resolve the resource path and ensure it's within base directory
-    resource_path = (resource_base_dir / resource_subpath).resolve()
+    resource_path = os.path.realpath(os.path.join(resource_base_dir, resource_subpath))
+    base_prefix = _base_prefix(resource_base_dir)
+    if not os.path.normcase(resource_path).startswith(base_prefix):
+        return "", None
 
-    # Security check: ensure resolved path is within base directory
     try:
-        base_str = str(resource_base_dir.resolve())
-        resource_str = str(resource_path)
-        # Ensure both paths use same separators and case for comparison
-        base_str = os.path.normcase(os.path.normpath(base_str))
-        resource_str = os.path.normcase(os.path.normpath(resource_str))
-        # Ensure base path ends with separator for accurate prefix matching
-        if not base_str.endswith(os.sep):
-            base_str += os.sep
-        # Check if resource path starts with base path
-        if not resource_str.startswith(base_str):
-            raise ValueError("Path traversal detected")
-    except ValueError:
-        raise HTTPException(status_code=403, detail="Access denied")
-
-    if not resource_path.exists() or not resource_path.is_file():
-        raise HTTPException(status_code=404, detail=f"Resource not found: {path}")
-
-    # Determine content type
-    content_type = None
-    suffix = resource_path.suffix.lower()
-    if suffix == ".css":
-        content_type = "text/css"
-    elif suffix in [".png", ".jpg", ".jpeg", ".gif", ".bmp", ".webp"]:
-        content_type = f"image/{suffix[1:]}"
-    elif suffix in [".mp3", ".wav", ".ogg", ".m4a"]:
-        content_type = "audio/mpeg"
-    elif suffix == ".js":
-        content_type = "application/javascript"
-    elif suffix == ".html":
-        content_type = "text/html"
-
-    return FileResponse(str(resource_path), media_type=content_type)
+        return resource_path, os.stat(resource_path)
+    except (FileNotFoundError, NotADirectoryError):
+        return "", None
+
+
+class ResourceFiles(StaticFiles):
+    """
+    Serve dictionary resource files (CSS, images, audio, etc.).
+
+    Works like StaticFiles, including ETag/Last-Modified and Range handling,
+    but the directory follows DEFAULT_DICT_PATH at request time and files
+    are sent with ZeroCopyFileResponse.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(directory=None, check_dir=False)
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        if scope["method"] not in ("GET", "HEAD"):
+            raise HTTPException(status_code=405)
+
+        # Resolve the directory once, on the event loop, and only resolve and
+        # stat the file in a worker thread
+        resource_base_dir, resource_subpath = _resource_location(path)
+        if resource_base_dir is None:
+            raise HTTPException(status_code=404, detail="No dictionary configured")
+
+        try:
+            full_path, stat_result = await anyio.to_thread.run_sync(
+                _stat_resource, resource_base_dir, resource_subpath
+            )
+        except PermissionError:
+            raise HTTPException(status_code=401)
+        except OSError as exc:
+            # Filename is too long, so it can't be a valid resource
+            if exc.errno == errno.ENAMETOOLONG:
+                raise HTTPException(status_code=404)
+            raise
+        except ValueError:
+            # Null bytes or other invalid characters in the path
+            raise HTTPException(status_code=404)
+
+        if stat_result is not None and stat.S_ISREG(stat_result.st_mode):
+            return self.file_response(full_path, stat_result, scope)
+        raise HTTPException(status_code=404)
+
+    def lookup_path(self, path: str) -> tuple[str, Optional[os.stat_result]]:
+        return _stat_resource(*_resource_location(path))
+
+    def file_response(
+        self,
+        full_path: str,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        etag = f'W/"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+        response = ZeroCopyFileResponse(
+            full_path,
+            status_code=status_code,
+            headers={"ETag": etag, "Cache-Control": RESOURCE_CACHE_CONTROL},
+            media_type=_MIME.get(Path(full_path).suffix.lower()),
+            stat_result=stat_result,
+        )
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
+
+    def is_not_modified(
+        self, response_headers: Headers, request_headers: Headers
+    ) -> bool:
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match and if_none_match.strip() != "*":
+            # If-None-Match uses weak comparison, ignore W/ on both sides
+            etag = response_headers["etag"].removeprefix("W/")
+            return etag in [
+                tag.strip().removeprefix("W/") for tag in if_none_match.split(",")
+            ]
+        return super().is_not_modified(response_headers, request_headers)
 
 
 # Get the directory containing this file
@@ -231,6 +507,7 @@ STATIC_DIR = CURRENT_DIR / "static"
 
 # Mount static files after all API routes are defined
 # This ensures API routes take precedence over static files
+app.mount("/resource", ResourceFiles(), name="resource")
 app.mount("/", StaticFiles(directory=str(STATIC_DIR), html=True), name="static")
 
 
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Custom ASGI responses used by the dictionary API.
+"""
+
+import os
+from typing import Any
+
+import anyio
+import orjson
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, JSONResponse
+from starlette.types import Receive, Scope, Send
+
+ZEROCOPY_EXTENSION = "http.response.zerocopysend"
+
+
+def json_bytes(content: Any) -> bytes:
+    """Serialize content to compact UTF-8 JSON, like ORJSONResponse does."""
+    return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+class ZeroCopyFileResponse(FileResponse):
+    """
+    FileResponse that hands the file descriptor to the server when it
+    supports the ASGI ``http.response.zerocopysend`` extension, so the
+    kernel copies bytes straight to the socket via ``sendfile(2)``.
+
+    Range requests, HEAD requests and servers without the extension fall
+    back to the regular chunked FileResponse behaviour.
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if not self._can_zerocopy(scope):
+            await super().__call__(scope, receive, send)
+            return
+
+        file = await anyio.to_thread.run_sync(open, self.path, "rb")
+        try:
+            stat_result = os.fstat(file.fileno())
+            self.headers["content-length"] = str(stat_result.st_size)
+            if self.stat_result is None:
+                self.set_stat_headers(stat_result)
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": self.status_code,
+                    "headers": self.raw_headers,
+                }
+            )
+            await send(
+                {
+                    "type": ZEROCOPY_EXTENSION,
+                    "file": file,
+                    "more_body": False,
+                }
+            )
+        finally:
+            await anyio.to_thread.run_sync(file.close)
+
+        if self.background is not None:
+            await self.background()
+
+    def _can_zerocopy(self, scope: Scope) -> bool:
+        if scope["type"] != "http" or scope["method"].upper() == "HEAD":
+            return False
+        if ZEROCOPY_EXTENSION not in scope.get("extensions", {}):
+            return False
+        # Partial content is served by the parent class
+        return self.status_code != 200 or Headers(scope=scope).get("range") is None
+
+
+class ORJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson, which serializes in C."""
+
+    def render(self, content: Any) -> bytes:
+        return json_bytes(content)
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+_index_kernel.py
+get_index 的数值内核：解析记录块信息表，把每个词条分配到它所在的记录块，
+计算记录结束偏移，并生成索引的各个整数列。
+安装了 numpy 时使用向量化的实现，否则退回等价的纯 Python 实现。
+"""
+
+from __future__ import absolute_import
+from itertools import accumulate
+from struct import Struct
+
+# NumPy 加速（可选）
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# 记录块信息表中每个 (压缩大小, 解压大小) 数对的格式，按单个数字的 struct 格式索引
+_BLOCK_SIZE_STRUCTS = {'>I': Struct('>II'), '>Q': Struct('>QQ')}
+_BLOCK_SIZE_DTYPES = {'>I': '>u4', '>Q': '>u8'}
+
+
+def block_table(buf, number_format, start):
+    """
+    解析记录块信息表。
+
+    参数:
+        buf: 记录块信息表的原始字节，依次为每块的 (压缩大小, 解压大小)
+        number_format: 单个数字的 struct 格式，'>I' 或 '>Q'
+        start: 第一个记录块在文件中的位置
+
+    返回:
+        (compressed_sizes, decompressed_sizes, file_positions, offsets) 四个等长整数列表，
+        offsets 为每块之前所有记录块的总解压大小。
+    """
+    if np is None:
+        pairs = list(_BLOCK_SIZE_STRUCTS[number_format].iter_unpack(buf))
+        compressed_sizes = [pair[0] for pair in pairs]
+        decompressed_sizes = [pair[1] for pair in pairs]
+        file_positions = list(accumulate(compressed_sizes, initial=start))[:-1]
+        offsets = list(accumulate(decompressed_sizes, initial=0))[:-1]
+        return compressed_sizes, decompressed_sizes, file_positions, offsets
+
+    sizes = np.frombuffer(buf, dtype=_BLOCK_SIZE_DTYPES[number_format])
+    sizes = sizes.reshape(-1, 2).astype(np.int64)
+    compressed_sizes = sizes[:, 0]
+    decompressed_sizes = sizes[:, 1]
+    file_positions = np.cumsum(compressed_sizes) - compressed_sizes + start
+    offsets = np.cumsum(decompressed_sizes) - decompressed_sizes
+    return (compressed_sizes.tolist(), decompressed_sizes.tolist(),
+            file_positions.tolist(), offsets.tolist())
+
+
+def _assign_blocks(starts, block_sizes, block_ix):
+    """
+    单次归并扫描词条起始偏移与记录块边界。
+
+    参数:
+        starts: 各词条在全部解压数据中的起始偏移（升序）
+        block_sizes: 各记录块解压后的大小
+        block_ix: 输出，各词条所在记录块的下标
+
+    返回:
+        成功分配到记录块的词条数，超出最后一个记录块的词条被忽略。
+    """
+    num_keys = len(starts)
+    offset = 0
+    key_idx = 0
+    for blk in range(len(block_sizes)):
+        size = block_sizes[blk]
+        while key_idx < num_keys and starts[key_idx] - offset < size:
+            block_ix[key_idx] = blk
+            key_idx += 1
+        offset += size
+    return key_idx
+
+
+def locate_records(starts, block_sizes):
+    """
+    计算每个词条所在的记录块下标和记录结束偏移。
+
+    记录结束偏移即下一个词条的起始偏移，整体错位一格得到，无需逐条判断；
+    最后一个词条的结束偏移为其所在记录块的末尾。
+
+    参数:
+        starts: 各词条的起始偏移列表（升序）
+        block_sizes: 各记录块解压后的大小列表
+
+    返回:
+        (block_ix, ends) 两个等长的整数列表，长度为成功分配的词条数。
+    """
+    if np is None:
+        num_keys = len(starts)
+        block_ix = [0] * num_keys
+        count = _assign_blocks(starts, block_sizes, block_ix)
+        del block_ix[count:]
+        ends = starts[1:count + 1]
+        if count and count == num_keys:
+            ends.append(sum(block_sizes[:block_ix[-1] + 1]))
+        return block_ix, ends
+
+    block_ix, ends = _locate_records_array(np.asarray(starts, dtype=np.int64), block_sizes)
+    # 转回 Python int，sqlite3 无法绑定 numpy 整数
+    return block_ix.tolist(), ends.tolist()
+
+
+def _locate_records_array(starts, block_sizes):
+    """locate_records 的 NumPy 实现，输入输出均为 int64 数组。"""
+    num_keys = len(starts)
+    block_ends = np.cumsum(np.asarray(block_sizes, dtype=np.int64))
+    # 每个词条所在的块即第一个末尾偏移大于其起始偏移的块，空块自然被跳过
+    block_ix = np.searchsorted(block_ends, starts, side='right')
+    count = int(np.searchsorted(block_ix, len(block_ends), side='left'))
+    block_ix = block_ix[:count]
+    ends = np.empty(count, dtype=np.int64)
+    next_starts = starts[1:count + 1]
+    ends[:len(next_starts)] = next_starts
+    if count and count == num_keys:
+        ends[-1] = block_ends[block_ix[-1]]
+    return block_ix, ends
+
+
+def gather_columns(block_ix, *block_columns):
+    """
+    按词条所在的记录块下标，把各记录块的列展开成与词条等长的列。
+
+    参数:
+        block_ix: 各词条所在记录块的下标列表（locate_records 的返回值）
+        block_columns: 若干个按记录块排列的整数列表
+
+    返回:
+        与 block_columns 一一对应的列表，每个长度均为 len(block_ix)。
+    """
+    if np is None:
+        return [list(map(column.__getitem__, block_ix)) for column in block_columns]
+
+    block_ix = np.asarray(block_ix, dtype=np.intp)
+    return [np.asarray(column, dtype=np.int64)[block_ix].tolist()
+            for column in block_columns]
+
+
+def build_columns(block_info, blk_types, starts):
+    """
+    生成索引中除 key_text 以外的 7 列（顺序同 INDEX_FIELDS）。
+
+    参数:
+        block_info: block_table 的返回值
+        blk_types: 各记录块的压缩类型
+        starts: 各词条的起始偏移列表（升序）
+
+    返回:
+        7 个等长的整数列表，长度为成功分配到记录块的词条数。
+    """
+    compressed_sizes, decompressed_sizes, file_positions, offsets = block_info
+    if np is None:
+        block_ix, ends = locate_records(starts, decompressed_sizes)
+        file_pos, csz, dsz, types, offs = gather_columns(
+            block_ix, file_positions, compressed_sizes, decompressed_sizes, blk_types, offsets)
+        return file_pos, csz, dsz, types, starts[:len(block_ix)], ends, offs
+
+    # 按记录块排列的 5 列放进一个 (5, 块数) 数组，一次花式索引展开到全部词条，
+    # 中间结果始终是 ndarray，最后才转回 Python int
+    table = np.array([file_positions, compressed_sizes, decompressed_sizes, blk_types, offsets],
+                     dtype=np.int64)
+    starts = np.asarray(starts, dtype=np.int64)
+    block_ix, ends = _locate_records_array(starts, table[2])
+    file_pos, csz, dsz, types, offs = table[:, block_ix].tolist()
+    return file_pos, csz, dsz, types, starts[:len(block_ix)].tolist(), ends.tolist(), offs
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+_packed_index.py
+可选的紧凑索引后端：与 SQLite 索引并存，用 marisa-trie 把词条映射到行号，
+用内存映射的 int64 数组保存每行的 7 个整数字段，查询时只需一次 trie 查找和数组取值。
+需要安装 numpy 和 marisa-trie，否则不可用。
+"""
+
+from __future__ import absolute_import
+import os
+
+# marisa-trie / NumPy（可选）
+try:
+    import numpy as np
+    import marisa_trie
+except ImportError:
+    np = None
+    marisa_trie = None
+
+# 数组每一列对应的索引字段，与 INDEX_FIELDS 去掉 key_text 后的顺序一致
+PACKED_FIELDS = ('file_pos', 'compressed_size', 'decompressed_size',
+                 'record_block_type', 'record_start', 'record_end', 'offset')
+
+# trie 中记录的行号格式
+_ROW_FORMAT = '<q'
+
+
+def available():
+    """当前环境是否可以使用紧凑索引。"""
+    return marisa_trie is not None
+
+
+def packed_paths(base):
+    """返回紧凑索引的 (数组文件, trie 文件) 路径。"""
+    return base + '.npy', base + '.trie'
+
+
+def write_packed_index(base, columns):
+    """
+    写出紧凑索引。
+
+    参数:
+        base: 文件路径前缀，实际写出 base.npy 与 base.trie
+        columns: get_index 返回的 8 个索引列（按 INDEX_FIELDS 排列）
+    """
+    array_path, trie_path = packed_paths(base)
+    keys = columns[0]
+    rows = np.array(columns[1:], dtype=np.int64).reshape(len(PACKED_FIELDS), len(keys)).T
+    trie = marisa_trie.RecordTrie(
+        _ROW_FORMAT, ((key, (i,)) for i, key in enumerate(keys)))
+    np.save(array_path, np.ascontiguousarray(rows))
+    trie.save(trie_path)
+
+
+def remove_packed_index(base):
+    """删除 base 对应的紧凑索引文件（不存在则忽略）。"""
+    for path in packed_paths(base):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class PackedIndex(object):
+    """以只读内存映射方式打开的紧凑索引。"""
+
+    def __init__(self, base):
+        array_path, trie_path = packed_paths(base)
+        self._rows = np.load(array_path, mmap_mode='r')
+        self._trie = marisa_trie.RecordTrie(_ROW_FORMAT).mmap(trie_path)
+
+    @classmethod
+    def open(cls, base):
+        """紧凑索引可用且文件存在时打开，否则返回 None。"""
+        if not available():
+            return None
+        if not all(os.path.exists(path) for path in packed_paths(base)):
+            return None
+        return cls(base)
+
+    def lookup(self, keyword):
+        """返回关键词对应的索引字典列表，顺序与词条在词典中的顺序一致。"""
+        rows = sorted(row for (row,) in self._trie.get(keyword, ()))
+        return [dict(zip(PACKED_FIELDS, self._rows[row].tolist())) for row in rows]
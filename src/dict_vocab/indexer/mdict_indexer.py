@@ -9,8 +9,16 @@ from __future__ import print_function, absolute_import
 import sys
 import os
 import json
+import mmap
+import re
 import sqlite3
-from struct import pack, unpack
+import string
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import cached_property, lru_cache
+from struct import Struct, calcsize, pack, unpack
 import zlib
 
 # 导入原版 readmdict 中的类
@@ -19,6 +27,11 @@ try:
 except ImportError:
     # 如果不是作为包运行，直接导入
     from dict_vocab.readmdict import MDX, MDD
+from dict_vocab.readmdict.readmdict import _fast_decrypt, _salsa_decrypt, ripemd128
+
+from dict_vocab.indexer import _packed_index
+from dict_vocab.indexer._index_kernel import block_table, build_columns
+from dict_vocab.indexer._packed_index import PackedIndex
 
 # LZO 压缩支持（可选）
 try:
@@ -31,217 +44,329 @@ except ImportError:
 if sys.hexversion >= 0x03000000:
     unicode = str
 
+# get_index 返回的索引元组中各字段的顺序，与 MDX_INDEX 表的列顺序一致
+INDEX_FIELDS = ('key_text', 'file_pos', 'compressed_size', 'decompressed_size',
+                'record_block_type', 'record_start', 'record_end', 'offset')
+
+# 记录块头部的压缩类型：0=无压缩，1=LZO，2=zlib
+_BLK_TYPE = {0: 0, 1: 1, 2: 2}
+
+# check_block 时后台解压校验记录块的线程数，同时也是排队等待校验的块数上限
+CHECK_BLOCK_WORKERS = 4
+
+# 已解压记录块的 LRU 缓存容量（块数），相邻词条通常落在同一个记录块中
+BLOCK_CACHE_SIZE = 64
+
+# 批量写入索引数据库时使用的 PRAGMA：索引库是可随时重建的产物，
+# 因此关闭日志和 fsync，并把临时数据与页缓存放在内存中
+BULK_LOAD_PRAGMAS = (
+    'PRAGMA journal_mode=OFF',
+    'PRAGMA synchronous=OFF',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-65536',
+    'PRAGMA locking_mode=EXCLUSIVE',
+)
+
+# 查询连接使用的 PRAGMA：以内存映射方式读取索引库（最多 1 GiB），
+# 热点 B 树页面直接由操作系统页缓存提供，不再经过 read() 拷贝
+LOOKUP_PRAGMAS = (
+    'PRAGMA query_only=ON',
+    'PRAGMA mmap_size=1073741824',
+    'PRAGMA cache_size=-32768',
+)
+
+# 单条 SQL 语句中绑定参数个数的上限（兼容 SQLITE_MAX_VARIABLE_NUMBER 的旧默认值 999）
+MAX_SQL_PARAMS = 900
+
+# 单个关键词的查询语句
+_LOOKUP_SQL = 'SELECT * FROM MDX_INDEX WHERE key_text = ?'
+_LOOKUP_SQL_NOCASE = 'SELECT * FROM MDX_INDEX WHERE lower(key_text) = lower(?)'
+
+# SQLite 的 lower() 只转换 ASCII 字母，在 Python 侧折叠大小写时须遵循同样的规则
+_ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+# 记录块区头部的格式，按 (是否为 3.0 版本, _number_format) 索引：3.0 版本为 4 字节块数加总大小，
+# 更早的版本为块数、词条数、信息表大小和记录块总大小，均按 _number_format 编码
+_RECORD_HEADER_STRUCTS = {
+    (True, '>I'): Struct('>II'),
+    (True, '>Q'): Struct('>IQ'),
+    (False, '>I'): Struct('>4I'),
+    (False, '>Q'): Struct('>4Q'),
+}
+
+# 通配符模式只支持 *，GLOB 中另有特殊含义的 ? 和 [ 转义为字面字符
+_GLOB_ESCAPE = str.maketrans({'?': '[?]', '[': '[[]'})
+
+# 样式标记形如 `1`，匹配标记编号及其后直到下一个样式标记之前的文本
+_STYLE_RE = re.compile(r'`(\d+)`([^`]*(?:`(?!\d+`)[^`]*)*)')
+
+
+def ascii_lower(text):
+    """按 SQLite lower() 的规则折叠大小写：只转换 ASCII 字母，"Ä" 保持不变。"""
+    return text.translate(_ASCII_LOWER)
+
+
+@lru_cache(maxsize=None)
+def _batch_lookup_sql(column, size):
+    """批量查询语句：按 column 匹配 size 个关键词，结果第一列为 column 的值。"""
+    return 'SELECT %s, * FROM MDX_INDEX WHERE %s IN (%s)' % (
+        column, column, ','.join('?' * size))
 
-class ExtendedMDX(MDX):
+
+@lru_cache(maxsize=256)
+def _wildcard_to_glob(pattern):
+    """把 get_mdx_keys 的通配符模式转换为 GLOB 模式。"""
+    return pattern.translate(_GLOB_ESCAPE)
+
+
+def _connect_for_bulk_load(db_path):
+    """打开用于构建索引的连接，事务由调用方显式 BEGIN/COMMIT。"""
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    for pragma in BULK_LOAD_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+@contextmanager
+def _bulk_load(db_path):
     """
-    扩展 MDX 类，添加 get_index 方法以生成索引列表和元数据。
+    在一个事务中写入新建的索引数据库，返回游标。
+
+    构建期间连接以 EXCLUSIVE 模式独占数据库，关闭连接后锁才释放，因此无论成功与否都会关闭连接；
+    由于日志已关闭、事务无法回滚，出错时直接删除写了一半的数据库，下次启动时会重新构建。
     """
-    def get_index(self, check_block=True):
-        """
-        遍历记录块，生成每个词条的索引信息。
+    conn = _connect_for_bulk_load(db_path)
+    try:
+        c = conn.cursor()
+        c.execute('BEGIN')
+        yield c
+        c.execute('COMMIT')
+    except BaseException:
+        conn.close()
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        raise
+    conn.close()
 
-        参数:
-            check_block: 如果为 True，则调用父类的 _decode_block 解压并验证数据，
-                         确保索引准确性（会消耗一些时间）；如果为 False，则仅读取
-                         块头信息，不实际解压（速度快，但无法校验数据完整性）。
 
-        返回:
-            字典，包含以下键：
-                'index_dict_list': 列表，每个元素为包含以下字段的字典：
-                    - key_text: 词条文本（字符串）
-                    - file_pos: 记录块在文件中的起始位置
-                    - compressed_size: 压缩块大小
-                    - decompressed_size: 解压后大小
-                    - record_block_type: 压缩类型（0=无压缩，1=LZO，2=zlib）
-                    - record_start: 本条记录在解压块中的起始偏移
-                    - record_end: 本条记录在解压块中的结束偏移
-                    - offset: 当前记录块之前所有记录块的总解压大小（用于计算记录在块内的偏移）
-                'meta': 元数据字典，包含编码、样式表、标题、描述等。
-        """
-        f = open(self._fname, 'rb')
-        f.seek(self._record_block_offset)
-
-        # 读取记录块头部信息（不同版本格式略有差异）
-        if self._version >= 3.0:
-            # MDict 3.0 格式：块数用 4 字节整数，后面紧跟总大小（忽略）
-            num_record_blocks = unpack('>I', f.read(4))[0]
-            total_size = self._read_number(f)   # 总大小，此处不关心
-        else:
-            num_record_blocks = self._read_number(f)
-            num_entries = self._read_number(f)  # 应与 self._num_entries 一致
-            record_block_info_size = self._read_number(f)
-            record_block_size = self._read_number(f)
-
-        # 读取每个记录块的信息（压缩前/后大小）
-        record_block_info_list = []
-        for _ in range(num_record_blocks):
-            if self._version >= 3.0:
-                compressed_size = unpack('>I', f.read(4))[0]
-                decompressed_size = unpack('>I', f.read(4))[0]
-            else:
-                compressed_size = self._read_number(f)
-                decompressed_size = self._read_number(f)
-            record_block_info_list.append((compressed_size, decompressed_size))
-
-        index_dict_list = []
-        offset = 0          # 所有已处理记录块的总解压大小
-        key_idx = 0         # 当前处理的词条在 _key_list 中的索引
-
-        for compressed_size, decompressed_size in record_block_info_list:
-            current_pos = f.tell()                 # 记录块的起始文件位置
-            block_compressed = f.read(compressed_size)
-
-            # 获取压缩类型（前4字节）
-            record_block_type = block_compressed[:4]
-            if record_block_type == b'\x00\x00\x00\x00':
-                blk_type = 0
-            elif record_block_type == b'\x01\x00\x00\x00':
-                blk_type = 1
-            elif record_block_type == b'\x02\x00\x00\x00':
-                blk_type = 2
-            else:
+def _read_block_table(buf, pos, num_record_blocks, number_format):
+    """
+    切出记录块信息表并整体解析（数值部分由 _index_kernel 完成）。
+
+    参数:
+        buf: 整个文件的内容（内存映射或字节串）
+        pos: 记录块信息表在文件中的位置，信息表之后紧接第一个记录块
+        num_record_blocks: 记录块数量
+        number_format: 单个数字的 struct 格式，'>I' 或 '>Q'
+
+    返回:
+        (compressed_sizes, decompressed_sizes, file_positions, offsets)，见 block_table。
+    """
+    end = pos + num_record_blocks * 2 * calcsize(number_format)
+    return block_table(buf[pos:end], number_format, end)
+
+
+def _check_decoded(pending):
+    """取出最早提交的解压任务，校验解压后的长度。"""
+    future, decompressed_size = pending.popleft()
+    assert len(future.result()) == decompressed_size
+
+
+def _decode_keys(key_list):
+    """
+    将 _key_list 中的 UTF-8 字节串词条一次性解码为字符串列表。
+
+    用不常见的分隔符拼接后整体 decode 再 split，避免逐条调用 decode 的开销；
+    若词条本身含有分隔符导致数量不一致，则退回逐条解码。
+    重复出现的词条（如交叉引用）共用同一个字符串对象，降低构建时的内存占用。
+    """
+    raw_keys = [key_text for _, key_text in key_list]
+    decoded = b'\x1f'.join(raw_keys).decode('utf-8').split(u'\x1f')
+    if len(decoded) != len(raw_keys):
+        decoded = [key_text.decode('utf-8') for key_text in raw_keys]
+    key_memo = {}
+    return [key_memo.setdefault(key_text, key_text) for key_text in decoded]
+
+
+class _IndexResult(dict):
+    """get_index 的返回值；按行排列的旧格式只在访问时由 'columns' 生成。"""
+
+    def __missing__(self, key):
+        if key == 'index_tuple_list':
+            return list(zip(*self['columns']))
+        if key == 'index_dict_list':
+            return [dict(zip(INDEX_FIELDS, row)) for row in zip(*self['columns'])]
+        raise KeyError(key)
+
+
+def _scan_index(mdict, check_block, empty_stylesheet=False):
+    """
+    遍历 MDict 对象的记录块，生成每个词条的索引信息（ExtendedMDX/ExtendedMDD 共用）。
+
+    参数:
+        mdict: 已解析文件头和词条列表的 MDX/MDD 对象
+        check_block: 如果为 True，则调用 _decode_block 解压并验证数据，
+                     确保索引准确性（会消耗一些时间）；如果为 False，则仅读取
+                     块头信息，不实际解压（速度快，但无法校验数据完整性）。
+        empty_stylesheet: 为 True 时元数据中的 stylesheet 为空（MDD 没有样式表）。
+
+    返回:
+        _IndexResult 字典，包含以下键（按行排列的 'index_tuple_list' / 'index_dict_list'
+        仅在访问时由 'columns' 临时生成）：
+            'columns': 按 INDEX_FIELDS 顺序排列的 8 个等长列表（列式存储）：
+                - key_text: 词条文本（字符串）
+                - file_pos: 记录块在文件中的起始位置
+                - compressed_size: 压缩块大小
+                - decompressed_size: 解压后大小
+                - record_block_type: 压缩类型（0=无压缩，1=LZO，2=zlib）
+                - record_start: 本条记录在解压块中的起始偏移
+                - record_end: 本条记录在解压块中的结束偏移
+                - offset: 当前记录块之前所有记录块的总解压大小（用于计算记录在块内的偏移）
+            'meta': 元数据字典，包含编码、样式表、标题、描述等。
+    """
+    # 整个文件以只读方式内存映射，各部分按文件位置直接切片，不再逐块 read()/seek()
+    with open(mdict._fname, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    # check_block 时解压交给线程池，与后续块的切片流水线并行
+    pool = ThreadPoolExecutor(CHECK_BLOCK_WORKERS) if check_block else None
+    pending = deque()
+    try:
+        # 解析记录块区头部（不同版本格式略有差异）；只用到块数，
+        # 其余字段（总大小 / 词条数、信息表大小、记录块总大小）此处不关心
+        is_v3 = mdict._version >= 3.0
+        header_struct = _RECORD_HEADER_STRUCTS[is_v3, mdict._number_format]
+        num_record_blocks = header_struct.unpack_from(mm, mdict._record_block_offset)[0]
+
+        # 解析每个记录块的信息（压缩前/后大小），
+        # 并算出各块的文件位置与偏移（此前所有记录块的总解压大小）
+        block_info = _read_block_table(
+            mm, mdict._record_block_offset + header_struct.size, num_record_blocks,
+            '>I' if is_v3 else mdict._number_format)
+
+        # 逐块读取块头，记录每个记录块的压缩类型
+        blk_types = []
+        for compressed_size, decompressed_size, block_pos in zip(*block_info[:3]):
+            # 解析压缩类型（前4字节，小端整数）；不校验时块的其余部分不会被访问
+            record_block_type = mm[block_pos:block_pos + 4]
+            blk_type = _BLK_TYPE.get(int.from_bytes(record_block_type, 'little'))
+            if blk_type is None:
                 raise Exception('未知的压缩类型: %r' % record_block_type)
 
-            # 如果 check_block 为 True，则调用父类 _decode_block 解压并验证
+            # 如果 check_block 为 True，则调用 _decode_block 解压并验证
             if check_block:
-                # _decode_block 会处理解密和解压，并返回完整数据
-                block_decompressed = self._decode_block(block_compressed, decompressed_size)
-                # 验证解压后长度
-                assert len(block_decompressed) == decompressed_size
-
-            # 根据 _key_list 切分当前块中的记录
-            while key_idx < len(self._key_list):
-                record_start, key_text = self._key_list[key_idx]
-                # 如果记录的起始偏移已经超出当前块，则跳出处理下一个块
-                if record_start - offset >= decompressed_size:
-                    break
-
-                # 计算记录结束位置
-                if key_idx + 1 < len(self._key_list):
-                    record_end = self._key_list[key_idx + 1][0]
-                else:
-                    record_end = decompressed_size + offset
-
-                # 构建索引条目
-                index_dict = {
-                    'file_pos': current_pos,
-                    'compressed_size': compressed_size,
-                    'decompressed_size': decompressed_size,
-                    'record_block_type': blk_type,
-                    'record_start': record_start,
-                    'record_end': record_end,
-                    'offset': offset,
-                    'key_text': key_text.decode('utf-8')   # key_text 已是 UTF-8 字节串
-                }
-                index_dict_list.append(index_dict)
-                key_idx += 1
-
-            offset += decompressed_size
-
-        f.close()
-
-        # 收集元数据
-        # 标题和描述可能以字节形式存在于 header 中
-        title = self.header.get(b'Title', b'').decode('utf-8', errors='ignore')
-        description = self.header.get(b'Description', b'').decode('utf-8', errors='ignore')
-        meta = {
-            'encoding': self._encoding,
-            'stylesheet': json.dumps(self._stylesheet, ensure_ascii=False),
-            'title': title,
-            'description': description,
-            'version': '1.0'   # 索引器版本
-        }
-        return {'index_dict_list': index_dict_list, 'meta': meta}
+                # _decode_block 会处理解密和解压，并返回完整数据；按提交顺序验证解压后长度
+                block_compressed = mm[block_pos:block_pos + compressed_size]
+                pending.append((pool.submit(mdict._decode_block, block_compressed,
+                                            decompressed_size), decompressed_size))
+                if len(pending) > CHECK_BLOCK_WORKERS:
+                    _check_decoded(pending)
+
+            blk_types.append(blk_type)
+
+        while pending:
+            _check_decoded(pending)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        mm.close()
+
+    # 根据 _key_list 把词条分配到记录块，生成各整数列（由 _index_kernel 完成）
+    starts = [record_start for record_start, _ in mdict._key_list]
+    int_columns = build_columns(block_info, blk_types, starts)
+    # 词条文本批量解码
+    columns = (_decode_keys(mdict._key_list[:len(int_columns[0])]),) + int_columns
+
+    # 收集元数据
+    # 标题和描述可能以字节形式存在于 header 中
+    title = mdict.header.get(b'Title', b'').decode('utf-8', errors='ignore')
+    description = mdict.header.get(b'Description', b'').decode('utf-8', errors='ignore')
+    if empty_stylesheet:
+        stylesheet = '{}'
+    else:
+        stylesheet = json.dumps(mdict._stylesheet, ensure_ascii=False)
+    meta = {
+        'encoding': mdict._encoding,
+        'stylesheet': stylesheet,
+        'title': title,
+        'description': description,
+        'version': '1.0'   # 索引器版本
+    }
+    return _IndexResult(columns=columns, meta=meta)
+
+
+class _DecodeBlockMixin(object):
+    """
+    覆盖 MDict._decode_block：仅在加密块（加密方式 1/2）上才用 ripemd128 推导密钥。
+    原版对每个块都计算一次纯 Python 的 ripemd128，而绝大多数块并未加密。
+    """
+    def _decode_block(self, block, decompressed_size):
+        # 块信息：压缩方式、加密方式
+        info = unpack('<L', block[:4])[0]
+        compression_method = info & 0xf
+        encryption_method = (info >> 4) & 0xf
+        encryption_size = (info >> 8) & 0xff
+
+        # 块数据的 adler32 校验值
+        adler32 = unpack('>I', block[4:8])[0]
+        data = block[8:]
+
+        # 解密
+        if encryption_method == 0:
+            decrypted_block = data
+        elif encryption_method in (1, 2):
+            # 未给出密钥时以校验值的 ripemd128 作为密钥
+            encrypted_key = self._encrypted_key
+            if encrypted_key is None:
+                encrypted_key = ripemd128(block[4:8])
+            if encryption_method == 1:
+                decrypt = _fast_decrypt
+            else:
+                decrypt = _salsa_decrypt
+            decrypted_block = decrypt(data[:encryption_size], encrypted_key) + data[encryption_size:]
+        else:
+            raise Exception('encryption method %d not supported' % encryption_method)
+
+        # v3 校验解密后的数据
+        if self._version >= 3:
+            assert(hex(adler32) == hex(zlib.adler32(decrypted_block) & 0xffffffff))
+
+        # 解压
+        if compression_method == 0:
+            decompressed_block = decrypted_block
+        elif compression_method == 1:
+            if lzo is None:
+                raise RuntimeError("LZO compression is not supported")
+            header = b'\xf0' + pack('>I', decompressed_size)
+            decompressed_block = lzo.decompress(header + decrypted_block)
+        elif compression_method == 2:
+            decompressed_block = zlib.decompress(decrypted_block)
+        else:
+            raise Exception('compression method %d not supported' % compression_method)
 
+        # v3 之前校验解压后的数据
+        if self._version < 3:
+            assert(hex(adler32) == hex(zlib.adler32(decompressed_block) & 0xffffffff))
 
-class ExtendedMDD(MDD):
+        return decompressed_block
+
+
+class ExtendedMDX(_DecodeBlockMixin, MDX):
     """
-    扩展 MDD 类，添加 get_index 方法。
+    扩展 MDX 类，添加 get_index 方法以生成索引列表和元数据。
     """
     def get_index(self, check_block=True):
-        """
-        与 ExtendedMDX.get_index 类似，但返回的元数据中 stylesheet 为空。
-        """
-        f = open(self._fname, 'rb')
-        f.seek(self._record_block_offset)
+        """遍历记录块，生成每个词条的索引信息和元数据，详见 _scan_index。"""
+        return _scan_index(self, check_block)
 
-        if self._version >= 3.0:
-            num_record_blocks = unpack('>I', f.read(4))[0]
-            total_size = self._read_number(f)
-        else:
-            num_record_blocks = self._read_number(f)
-            num_entries = self._read_number(f)
-            record_block_info_size = self._read_number(f)
-            record_block_size = self._read_number(f)
-
-        record_block_info_list = []
-        for _ in range(num_record_blocks):
-            if self._version >= 3.0:
-                compressed_size = unpack('>I', f.read(4))[0]
-                decompressed_size = unpack('>I', f.read(4))[0]
-            else:
-                compressed_size = self._read_number(f)
-                decompressed_size = self._read_number(f)
-            record_block_info_list.append((compressed_size, decompressed_size))
-
-        index_dict_list = []
-        offset = 0
-        key_idx = 0
-
-        for compressed_size, decompressed_size in record_block_info_list:
-            current_pos = f.tell()
-            block_compressed = f.read(compressed_size)
-
-            record_block_type = block_compressed[:4]
-            if record_block_type == b'\x00\x00\x00\x00':
-                blk_type = 0
-            elif record_block_type == b'\x01\x00\x00\x00':
-                blk_type = 1
-            elif record_block_type == b'\x02\x00\x00\x00':
-                blk_type = 2
-            else:
-                raise Exception('未知的压缩类型: %r' % record_block_type)
 
-            if check_block:
-                block_decompressed = self._decode_block(block_compressed, decompressed_size)
-                assert len(block_decompressed) == decompressed_size
-
-            while key_idx < len(self._key_list):
-                record_start, key_text = self._key_list[key_idx]
-                if record_start - offset >= decompressed_size:
-                    break
-                if key_idx + 1 < len(self._key_list):
-                    record_end = self._key_list[key_idx + 1][0]
-                else:
-                    record_end = decompressed_size + offset
-
-                index_dict = {
-                    'file_pos': current_pos,
-                    'compressed_size': compressed_size,
-                    'decompressed_size': decompressed_size,
-                    'record_block_type': blk_type,
-                    'record_start': record_start,
-                    'record_end': record_end,
-                    'offset': offset,
-                    'key_text': key_text.decode('utf-8')
-                }
-                index_dict_list.append(index_dict)
-                key_idx += 1
-
-            offset += decompressed_size
-
-        f.close()
-
-        title = self.header.get(b'Title', b'').decode('utf-8', errors='ignore')
-        description = self.header.get(b'Description', b'').decode('utf-8', errors='ignore')
-        meta = {
-            'encoding': self._encoding,
-            'stylesheet': '{}',
-            'title': title,
-            'description': description,
-            'version': '1.0'
-        }
-        return {'index_dict_list': index_dict_list, 'meta': meta}
+class ExtendedMDD(_DecodeBlockMixin, MDD):
+    """
+    扩展 MDD 类，添加 get_index 方法。
+    """
+    def get_index(self, check_block=True):
+        """与 ExtendedMDX.get_index 类似，但返回的元数据中 stylesheet 为空。"""
+        return _scan_index(self, check_block, empty_stylesheet=True)
 
 
 class IndexBuilder(object):
@@ -249,7 +374,7 @@ class IndexBuilder(object):
     索引构建器：基于扩展后的 MDX/MDD 类，构建 SQLite 索引数据库并提供查询接口。
     """
     def __init__(self, fname, encoding='', passcode=None, force_rebuild=False,
-                 sql_index=True, check=False):
+                 sql_index=True, check=False, packed_index=False):
         """
         参数:
             fname: MDX 文件路径
@@ -258,6 +383,8 @@ class IndexBuilder(object):
             force_rebuild: 强制重建索引数据库（即使已存在）
             sql_index: 是否在数据库表上创建索引以加速查询
             check: 构建索引时是否校验块数据（调用 _decode_block 解压验证）
+            packed_index: 同时构建紧凑索引（需要 numpy 和 marisa-trie），
+                          区分大小写的 MDX 查询改用它而不是 SQLite
         """
         self._mdx_file = os.path.abspath(fname)
         base, ext = os.path.splitext(self._mdx_file)
@@ -271,6 +398,13 @@ class IndexBuilder(object):
 
         # MDX 数据库路径
         self._mdx_db = base + '.mdx.db'
+        # 紧凑索引文件前缀（可选后端）
+        if packed_index and not _packed_index.available():
+            print("警告: numpy 或 marisa-trie 未安装，不使用紧凑索引")
+            packed_index = False
+        self._packed_index = packed_index
+        self._packed_base = base + '.mdx.idx'
+        self._packed = None
         # MDD 文件及数据库（如果存在）
         self._mdd_file = base + '.mdd'
         self._mdd_db = base + '.mdd.db' if os.path.exists(self._mdd_file) else None
@@ -279,14 +413,32 @@ class IndexBuilder(object):
         self._mdx_obj = None
         self._mdd_obj = None
 
+        # 查询用的持久数据库连接（按数据库路径缓存），多线程共用，由锁串行化访问
+        self._conns = {}
+        self._conn_lock = threading.Lock()
+
+        # 最近解压过的记录块：(文件名, 块文件位置) -> 解压后数据
+        self._block_cache = OrderedDict()
+        self._block_lock = threading.Lock()
+
+        # 查询时按需建立的 MDX/MDD 文件只读内存映射：文件名 -> mmap
+        self._mmaps = {}
+        self._mmap_lock = threading.Lock()
+
+        # META 中保存的样式表 JSON，首次用到 _stylesheet 时才解析
+        self._stylesheet_json = '{}'
+
         # 构建或加载索引
         self._prepare_indexes(force_rebuild)
 
     def _prepare_indexes(self, force_rebuild):
         """确保索引数据库存在，并加载元数据到实例变量。"""
         # 处理 MDX
-        if force_rebuild or not os.path.exists(self._mdx_db):
-            self._build_mdx_index()
+        packed_missing = self._packed_index and not all(
+            os.path.exists(path) for path in _packed_index.packed_paths(self._packed_base))
+        builds = []
+        if force_rebuild or packed_missing or not os.path.exists(self._mdx_db):
+            builds.append(self._build_mdx_index)
         else:
             # 从现有数据库加载元数据
             self._load_meta_from_db(self._mdx_db)
@@ -294,55 +446,69 @@ class IndexBuilder(object):
         # 处理 MDD（如果存在）
         if self._mdd_file and os.path.exists(self._mdd_file):
             if force_rebuild or not os.path.exists(self._mdd_db):
-                self._build_mdd_index()
+                builds.append(self._build_mdd_index)
+
+        # MDX 与 MDD 索引写入不同的数据库文件、各自打开连接，互不依赖，需要时并行构建
+        if len(builds) > 1:
+            with ThreadPoolExecutor(max_workers=len(builds)) as pool:
+                futures = [pool.submit(build) for build in builds]
+            for future in futures:
+                future.result()
+        else:
+            for build in builds:
+                build()
 
     def _build_mdx_index(self):
-        """构建 MDX 索引数据库。"""
+        """构建 MDX 索引数据库（启用时同时构建紧凑索引）。"""
+        if os.path.exists(self._mdx_db):
+            os.remove(self._mdx_db)
+        # 旧的紧凑索引对应旧的数据库，无论本次是否启用都一并删除，
+        # 以免之后以 packed_index=True 打开时用上与数据库不一致的索引
+        _packed_index.remove_packed_index(self._packed_base)
+
         print("正在构建 MDX 索引: %s" % self._mdx_db)
         # 创建扩展 MDX 实例
         mdx = ExtendedMDX(self._mdx_file, encoding=self._encoding, passcode=self._passcode)
         self._mdx_obj = mdx   # 保留实例供后续查询
         result = mdx.get_index(check_block=self._check)
-        index_list = result['index_dict_list']
+        columns = result['columns']
         meta = result['meta']
 
-        # 写入 SQLite
-        conn = sqlite3.connect(self._mdx_db)
-        c = conn.cursor()
-        c.execute('''CREATE TABLE MDX_INDEX (
-            key_text TEXT NOT NULL,
-            file_pos INTEGER,
-            compressed_size INTEGER,
-            decompressed_size INTEGER,
-            record_block_type INTEGER,
-            record_start INTEGER,
-            record_end INTEGER,
-            offset INTEGER
-        )''')
-        tuples = [(item['key_text'], item['file_pos'], item['compressed_size'],
-                   item['decompressed_size'], item['record_block_type'],
-                   item['record_start'], item['record_end'], item['offset'])
-                  for item in index_list]
-        c.executemany('INSERT INTO MDX_INDEX VALUES (?,?,?,?,?,?,?,?)', tuples)
-
-        c.execute('CREATE TABLE META (key TEXT, value TEXT)')
-        c.executemany('INSERT INTO META VALUES (?,?)', [
-            ('encoding', meta['encoding']),
-            ('stylesheet', meta['stylesheet']),
-            ('title', meta['title']),
-            ('description', meta['description']),
-            ('version', meta['version'])
-        ])
-
-        if self._sql_index:
-            c.execute('CREATE INDEX key_index ON MDX_INDEX (key_text)')
-
-        conn.commit()
-        conn.close()
+        # 写入 SQLite（整个构建过程放在一个事务中）
+        with _bulk_load(self._mdx_db) as c:
+            c.execute('''CREATE TABLE MDX_INDEX (
+                key_text TEXT NOT NULL,
+                file_pos INTEGER,
+                compressed_size INTEGER,
+                decompressed_size INTEGER,
+                record_block_type INTEGER,
+                record_start INTEGER,
+                record_end INTEGER,
+                offset INTEGER
+            )''')
+            c.executemany('INSERT INTO MDX_INDEX VALUES (?,?,?,?,?,?,?,?)', zip(*columns))
+
+            c.execute('CREATE TABLE META (key TEXT, value TEXT)')
+            c.executemany('INSERT INTO META VALUES (?,?)', [
+                ('encoding', meta['encoding']),
+                ('stylesheet', meta['stylesheet']),
+                ('title', meta['title']),
+                ('description', meta['description']),
+                ('version', meta['version'])
+            ])
+
+            # 索引在全部数据写入后一次性建立，并收集统计信息供查询规划使用。
+            # 索引包含查询用到的全部列（覆盖索引），查到词条后无需再回表读取行
+            if self._sql_index:
+                c.execute('CREATE INDEX key_cover ON MDX_INDEX (%s)' % ', '.join(INDEX_FIELDS))
+                c.execute('ANALYZE MDX_INDEX')
+
+        if self._packed_index:
+            _packed_index.write_packed_index(self._packed_base, columns)
 
         # 更新实例变量中的元数据
         self._encoding = meta['encoding']
-        self._stylesheet = json.loads(meta['stylesheet'])
+        self._stylesheet_json = meta['stylesheet']
         self._title = meta['title']
         self._description = meta['description']
 
@@ -355,51 +521,41 @@ class IndexBuilder(object):
         mdd = ExtendedMDD(self._mdd_file, passcode=self._passcode)
         self._mdd_obj = mdd
         result = mdd.get_index(check_block=self._check)
-        index_list = result['index_dict_list']
-
-        conn = sqlite3.connect(self._mdd_db)
-        c = conn.cursor()
-        c.execute('''CREATE TABLE MDX_INDEX (
-            key_text TEXT NOT NULL UNIQUE,
-            file_pos INTEGER,
-            compressed_size INTEGER,
-            decompressed_size INTEGER,
-            record_block_type INTEGER,
-            record_start INTEGER,
-            record_end INTEGER,
-            offset INTEGER
-        )''')
-        tuples = [(item['key_text'], item['file_pos'], item['compressed_size'],
-                   item['decompressed_size'], item['record_block_type'],
-                   item['record_start'], item['record_end'], item['offset'])
-                  for item in index_list]
-        c.executemany('INSERT INTO MDX_INDEX VALUES (?,?,?,?,?,?,?,?)', tuples)
-
-        if self._sql_index:
-            c.execute('CREATE UNIQUE INDEX key_index ON MDX_INDEX (key_text)')
-
-        conn.commit()
-        conn.close()
+        columns = result['columns']
+
+        with _bulk_load(self._mdd_db) as c:
+            # MDD 的资源名唯一，直接以 key_text 为主键建成 WITHOUT ROWID 表：
+            # 表本身就是按 key_text 排序的 B 树，查询只需一次下降，也不再需要单独的索引
+            c.execute('''CREATE TABLE MDX_INDEX (
+                key_text TEXT NOT NULL PRIMARY KEY,
+                file_pos INTEGER,
+                compressed_size INTEGER,
+                decompressed_size INTEGER,
+                record_block_type INTEGER,
+                record_start INTEGER,
+                record_end INTEGER,
+                offset INTEGER
+            ) WITHOUT ROWID''')
+            c.executemany('INSERT INTO MDX_INDEX VALUES (?,?,?,?,?,?,?,?)', zip(*columns))
 
     def _load_meta_from_db(self, db_path):
         """从已存在的 SQLite 数据库加载元数据到实例变量。"""
-        conn = sqlite3.connect(db_path)
-        c = conn.cursor()
-        try:
-            c.execute("SELECT key, value FROM META")
-            for key, value in c:
-                if key == 'encoding':
-                    self._encoding = value
-                elif key == 'stylesheet':
-                    self._stylesheet = json.loads(value)
-                elif key == 'title':
-                    self._title = value
-                elif key == 'description':
-                    self._description = value
-        except sqlite3.OperationalError:
-            # 可能没有 META 表（旧版数据库），忽略
-            pass
-        conn.close()
+        with self._conn_lock:
+            c = self._connect(db_path).cursor()
+            try:
+                c.execute("SELECT key, value FROM META")
+                for key, value in c:
+                    if key == 'encoding':
+                        self._encoding = value
+                    elif key == 'stylesheet':
+                        self._stylesheet_json = value
+                    elif key == 'title':
+                        self._title = value
+                    elif key == 'description':
+                        self._description = value
+            except sqlite3.OperationalError:
+                # 可能没有 META 表（旧版数据库），忽略
+                pass
 
     # ---------- 查询接口 ----------
     def mdx_lookup(self, keyword, ignorecase=False):
@@ -413,16 +569,65 @@ class IndexBuilder(object):
         返回:
             释义列表（字符串），每个元素对应一个匹配词条（通常只有一个，除非文件有重复词条）。
         """
-        indexes = self._lookup_indexes(self._mdx_db, keyword, ignorecase)
+        packed = None if ignorecase else self._get_packed()
+        if packed is not None:
+            indexes = packed.lookup(keyword)
+        else:
+            indexes = self._lookup_indexes(self._mdx_db, keyword, ignorecase)
+        return self._read_definitions(indexes)
+
+    def mdx_lookup_batch(self, keywords, ignorecase=False):
+        """
+        批量查询 MDX 词条：用一条 IN (...) 查询取出全部索引，再按 file_pos 顺序
+        提取释义，使落在同一记录块的词条连续命中块缓存。
+
+        参数:
+            keywords: 查询关键词列表
+            ignorecase: 是否忽略大小写
+
+        返回:
+            与 keywords 一一对应的释义列表，每个元素同 mdx_lookup 的返回值。
+        """
+        packed = None if ignorecase else self._get_packed()
+        if packed is not None:
+            indexes_by_key = {keyword: packed.lookup(keyword) for keyword in set(keywords)}
+        else:
+            with self._conn_lock:
+                conn = self._connect(self._mdx_db)
+                if conn is None:
+                    return [[] for _ in keywords]
+                indexes_by_key = self._query_indexes_batch(conn, keywords, ignorecase)
+
+        if ignorecase:
+            keys = [ascii_lower(keyword) for keyword in keywords]
+        else:
+            keys = keywords
+        index_lists = [indexes_by_key.get(key, []) for key in keys]
+
+        # 去重后按记录块在文件中的位置排序提取，重复的关键词共用结果
+        unique = list({id(idx): idx for indexes in index_lists for idx in indexes}.values())
+        unique.sort(key=lambda idx: idx['file_pos'])
+        texts = dict(zip(map(id, unique), self._read_definitions(unique)))
+        return [[texts[id(idx)] for idx in indexes] for indexes in index_lists]
+
+    def _get_packed(self):
+        """启用紧凑索引时返回已打开的 PackedIndex，否则返回 None。"""
+        if self._packed_index and self._packed is None:
+            self._packed = PackedIndex.open(self._packed_base)
+        return self._packed
+
+    def _read_definitions(self, indexes):
+        """根据索引列表提取并解码 MDX 释义。"""
         if not indexes:
             return []
-        # 确保 _mdx_obj 已存在，否则创建临时实例
-        if self._mdx_obj is None:
-            self._mdx_obj = ExtendedMDX(self._mdx_file, encoding=self._encoding,
-                                        passcode=self._passcode)
+        # 确保 _mdx_obj 已存在，否则创建临时实例；只读取一次，close() 随时可能将其置空
+        mdx_obj = self._mdx_obj
+        if mdx_obj is None:
+            mdx_obj = self._mdx_obj = ExtendedMDX(self._mdx_file, encoding=self._encoding,
+                                                  passcode=self._passcode)
         results = []
         for idx in indexes:
-            data = self._extract_data(self._mdx_obj, idx)
+            data = self._extract_data(mdx_obj, idx)
             # 解码并处理样式
             text = data.decode(self._encoding, errors='ignore').strip('\x00')
             if self._stylesheet:
@@ -446,70 +651,129 @@ class IndexBuilder(object):
         indexes = self._lookup_indexes(self._mdd_db, keyword, ignorecase)
         if not indexes:
             return []
-        if self._mdd_obj is None:
-            self._mdd_obj = ExtendedMDD(self._mdd_file, passcode=self._passcode)
+        mdd_obj = self._mdd_obj
+        if mdd_obj is None:
+            mdd_obj = self._mdd_obj = ExtendedMDD(self._mdd_file, passcode=self._passcode)
         results = []
         for idx in indexes:
-            data = self._extract_data(self._mdd_obj, idx)
+            data = self._extract_data(mdd_obj, idx)
             results.append(data)
         return results
 
     def _lookup_indexes(self, db_path, keyword, ignorecase):
         """从指定数据库查询关键词对应的索引列表。"""
-        if not os.path.exists(db_path):
-            return []
-        conn = sqlite3.connect(db_path)
-        c = conn.cursor()
+        with self._conn_lock:
+            conn = self._connect(db_path)
+            if conn is None:
+                return []
+            return self._query_indexes(conn, keyword, ignorecase)
+
+    def _connect(self, db_path):
+        """
+        返回 db_path 上的持久只读连接，首次使用时打开；数据库不存在时返回 None。
+        调用方需持有 _conn_lock。
+        """
+        conn = self._conns.get(db_path)
+        if conn is None:
+            if not os.path.exists(db_path):
+                return None
+            conn = sqlite3.connect(db_path, check_same_thread=False)
+            for pragma in LOOKUP_PRAGMAS:
+                conn.execute(pragma)
+            self._conns[db_path] = conn
+        return conn
+
+    def _query_indexes(self, conn, keyword, ignorecase):
+        """在已打开的数据库连接上查询关键词对应的索引列表。"""
+        # SQL 文本固定，连接的语句缓存直接复用已编译的语句
+        # （ignorecase 使用 LOWER 函数会使索引失效，适合小数据量）
+        c = conn.execute(_LOOKUP_SQL_NOCASE if ignorecase else _LOOKUP_SQL, (keyword,))
+        return [self._index_from_row(row) for row in c]
+
+    def _query_indexes_batch(self, conn, keywords, ignorecase):
+        """
+        用 IN (...) 查询一组关键词的索引，返回 {关键词: 索引列表}。
+        ignorecase 时字典的键为 lower() 之后的关键词。
+        """
+        column = 'lower(key_text)' if ignorecase else 'key_text'
         if ignorecase:
-            # 使用 LOWER 函数会使索引失效，适合小数据量
-            sql = 'SELECT * FROM MDX_INDEX WHERE lower(key_text) = lower(?)'
-        else:
-            sql = 'SELECT * FROM MDX_INDEX WHERE key_text = ?'
-        c.execute(sql, (keyword,))
-        rows = c.fetchall()
-        conn.close()
-        indexes = []
-        for row in rows:
-            indexes.append({
-                'file_pos': row[1],
-                'compressed_size': row[2],
-                'decompressed_size': row[3],
-                'record_block_type': row[4],
-                'record_start': row[5],
-                'record_end': row[6],
-                'offset': row[7]
-            })
-        return indexes
+            keywords = [ascii_lower(keyword) for keyword in keywords]
+        params = list(dict.fromkeys(keywords))
+        indexes_by_key = {}
+        for i in range(0, len(params), MAX_SQL_PARAMS):
+            chunk = params[i:i + MAX_SQL_PARAMS]
+            # 参数个数向上取整到 2 的幂，用最后一个关键词补齐（IN 中重复的值不影响结果），
+            # 这样 SQL 文本只有少数几种，不会挤占语句缓存，已编译的语句得以复用
+            size = min(1 << (len(chunk) - 1).bit_length(), MAX_SQL_PARAMS)
+            chunk += chunk[-1:] * (size - len(chunk))
+            c = conn.execute(_batch_lookup_sql(column, size), chunk)
+            for row in c:
+                indexes_by_key.setdefault(row[0], []).append(self._index_from_row(row[1:]))
+        return indexes_by_key
+
+    @staticmethod
+    def _index_from_row(row):
+        """把 MDX_INDEX 表的一行转换为 _extract_data 使用的索引字典。"""
+        return {
+            'file_pos': row[1],
+            'compressed_size': row[2],
+            'decompressed_size': row[3],
+            'record_block_type': row[4],
+            'record_start': row[5],
+            'record_end': row[6],
+            'offset': row[7]
+        }
 
     def _extract_data(self, mdict_obj, index):
         """
         根据索引，使用 MDict 对象的 _decode_block 方法提取数据。
         此方法复用原版的解密/解压逻辑。
         """
-        with open(mdict_obj._fname, 'rb') as f:
-            f.seek(index['file_pos'])
-            block_compressed = f.read(index['compressed_size'])
-            # 调用原版 _decode_block 获取完整解压数据
-            block_decompressed = mdict_obj._decode_block(
-                block_compressed, index['decompressed_size'])
+        block_decompressed = self._decode_block_cached(mdict_obj, index)
         start = index['record_start'] - index['offset']
         end = index['record_end'] - index['offset']
         return block_decompressed[start:end]
 
+    def _decode_block_cached(self, mdict_obj, index):
+        """读取并解压 index 所在的记录块，最近使用的 BLOCK_CACHE_SIZE 个块缓存在内存中。"""
+        key = (mdict_obj._fname, index['file_pos'])
+        with self._block_lock:
+            block_decompressed = self._block_cache.get(key)
+            if block_decompressed is not None:
+                self._block_cache.move_to_end(key)
+                return block_decompressed
+
+        # 从内存映射中直接切出压缩块，由操作系统页缓存提供数据，无需 read() 系统调用
+        file_pos = index['file_pos']
+        with self._mmap_lock:
+            mm = self._mmaps.get(mdict_obj._fname)
+            if mm is None:
+                with open(mdict_obj._fname, 'rb') as f:
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._mmaps[mdict_obj._fname] = mm
+            block_compressed = mm[file_pos:file_pos + index['compressed_size']]
+        # 调用原版 _decode_block 获取完整解压数据
+        block_decompressed = mdict_obj._decode_block(
+            block_compressed, index['decompressed_size'])
+
+        with self._block_lock:
+            self._block_cache[key] = block_decompressed
+            if len(self._block_cache) > BLOCK_CACHE_SIZE:
+                self._block_cache.popitem(last=False)
+        return block_decompressed
+
     def _replace_stylesheet(self, text):
-        """替换样式标记。"""
-        import re
-        # 样式标记形如 `1`，分割文本
-        parts = re.split(r'`\d+`', text)
-        tags = re.findall(r'`\d+`', text)
-        styled = parts[0]
-        for i, part in enumerate(parts[1:]):
-            style = self._stylesheet.get(tags[i][1:-1], ('', ''))
-            if part and part.endswith('\n'):
-                styled += style[0] + part.rstrip() + style[1] + '\r\n'
-            else:
-                styled += style[0] + part + style[1]
-        return styled
+        """替换样式标记，单次扫描完成。"""
+        stylesheet = self._stylesheet
+
+        def _sub(match):
+            style = stylesheet.get(match.group(1), ('', ''))
+            part = match.group(2)
+            if part.endswith('\n'):
+                return style[0] + part.rstrip() + style[1] + '\r\n'
+            return style[0] + part + style[1]
+
+        return _STYLE_RE.sub(_sub, text)
 
     def get_mdx_keys(self, pattern=''):
         """
@@ -530,20 +794,39 @@ class IndexBuilder(object):
         return []
 
     def _get_keys(self, db_path, pattern):
-        if not os.path.exists(db_path):
-            return []
-        conn = sqlite3.connect(db_path)
-        c = conn.cursor()
-        if pattern:
-            sql_pattern = pattern.replace('*', '%')
-            # SQL LIKE 中的 % 匹配任意字符，_ 匹配单个字符，这里只支持 *
-            c.execute('SELECT key_text FROM MDX_INDEX WHERE key_text LIKE ?',
-                      (sql_pattern,))
-        else:
-            c.execute('SELECT key_text FROM MDX_INDEX')
-        keys = [row[0] for row in c]
-        conn.close()
-        return keys
+        with self._conn_lock:
+            conn = self._connect(db_path)
+            if conn is None:
+                return []
+            c = conn.cursor()
+            if pattern:
+                # GLOB 区分大小写，前缀固定的模式（如 'ab*'）可以使用 key_cover 做范围扫描
+                c.execute('SELECT key_text FROM MDX_INDEX WHERE key_text GLOB ? '
+                          'ORDER BY key_text', (_wildcard_to_glob(pattern),))
+            else:
+                c.execute('SELECT key_text FROM MDX_INDEX')
+            return [row[0] for row in c]
+
+    def close(self):
+        """释放数据库连接、记录块缓存、内存映射和 MDX/MDD 实例，之后的查询会按需重新创建。"""
+        with self._conn_lock:
+            for conn in self._conns.values():
+                conn.close()
+            self._conns.clear()
+        with self._block_lock:
+            self._block_cache.clear()
+        with self._mmap_lock:
+            for mm in self._mmaps.values():
+                mm.close()
+            self._mmaps.clear()
+        self._packed = None
+        self._mdx_obj = None
+        self._mdd_obj = None
+
+    @cached_property
+    def _stylesheet(self):
+        """样式表字典，首次访问时才解析 JSON；只查询 MDD 资源时不会解析。"""
+        return json.loads(self._stylesheet_json)
 
     # 属性访问，方便获取元数据
     @property
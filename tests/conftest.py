@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+"""Shared pytest fixtures."""
+
+import pytest
+
+from dict_vocab.indexer.mdict_indexer import BULK_LOAD_PRAGMAS
+
+
+@pytest.fixture(scope="session")
+def sqlite_fast_pragmas():
+    """返回一个函数，把 IndexBuilder 构建索引时使用的 PRAGMA 应用到测试数据库连接上。"""
+    def apply(conn):
+        for pragma in BULK_LOAD_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+    return apply
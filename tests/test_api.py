@@ -12,10 +12,29 @@ import json
 from pathlib import Path
 from unittest.mock import MagicMock, patch
 
+import anyio
 import pytest
 from fastapi.testclient import TestClient
 
+from dict_vocab.api import main
+from dict_vocab.api.batching import LookupBatcher
+from dict_vocab.api.cache import LRUCache, TTLCache
 from dict_vocab.api.main import app, get_dict_builder, DEFAULT_DICT_PATH
+from dict_vocab.api.responses import ORJSONResponse, ZeroCopyFileResponse
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    """Keep cached builders and lookup results from leaking between tests."""
+    main._dict_cache.clear()
+    main._lookup_cache.clear()
+    main._exists_cache.clear()
+    main._lookup_batchers.clear()
+    yield
+    main._dict_cache.clear()
+    main._lookup_cache.clear()
+    main._exists_cache.clear()
+    main._lookup_batchers.clear()
 
 
 @pytest.fixture
@@ -45,6 +64,30 @@ class TestHealthCheck:
         assert response.json() == {"status": "ok"}
 
 
+class TestStartup:
+    """Test application startup."""
+
+    def test_default_dict_loaded_on_startup(self, mock_builder, monkeypatch):
+        """Test the default dictionary is loaded before serving requests."""
+        monkeypatch.delenv("DEFAULT_DICT_PATH", raising=False)
+        with patch("dict_vocab.api.main.DEFAULT_DICT_PATH", "/test/dict.mdx"):
+            with patch("dict_vocab.api.main.os.path.exists", return_value=True):
+                with patch(
+                    "dict_vocab.api.main.get_dict_builder", return_value=mock_builder
+                ) as get_builder:
+                    with TestClient(app):
+                        get_builder.assert_called_once_with("/test/dict.mdx")
+
+    def test_startup_without_default_dict(self, monkeypatch):
+        """Test startup skips preloading when the default dict is missing."""
+        monkeypatch.delenv("DEFAULT_DICT_PATH", raising=False)
+        with patch("dict_vocab.api.main.DEFAULT_DICT_PATH", "/missing/dict.mdx"):
+            with patch("dict_vocab.api.main.get_dict_builder") as get_builder:
+                with TestClient(app) as client:
+                    assert client.get("/health").status_code == 200
+                get_builder.assert_not_called()
+
+
 class TestListDicts:
     """Test list dictionaries endpoint."""
 
@@ -137,6 +180,236 @@ class TestLookup:
                 assert response.status_code == 200
                 mock_builder.mdx_lookup.assert_called_with("Test", ignorecase=True)
 
+    def test_lookup_runs_in_worker_thread(self, client, mock_builder):
+        """Test blocking lookups are offloaded from the event loop thread."""
+        import asyncio
+
+        loop_running = []
+
+        def fake_lookup(word, ignorecase=False):
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                loop_running.append(False)
+            else:
+                loop_running.append(True)
+            return ["definition"]
+
+        mock_builder.mdx_lookup.side_effect = fake_lookup
+
+        with patch("dict_vocab.api.main.os.path.exists", return_value=True):
+            with patch(
+                "dict_vocab.api.main.get_dict_builder", return_value=mock_builder
+            ):
+                response = client.post(
+                    "/lookup", json={"word": "test", "dict_path": "/test/dict.mdx"}
+                )
+                assert response.status_code == 200
+                assert loop_running == [False]
+
+    def test_lookup_result_cached(self, client, mock_builder):
+        """Test repeated lookups are answered from the result cache."""
+        main._dict_cache["/test/dict.mdx"] = mock_builder
+        with patch("dict_vocab.api.main.os.path.exists", return_value=True):
+            with patch(
+                "dict_vocab.api.main.get_dict_builder", return_value=mock_builder
+            ):
+                for word in ["Test", "test", "TEST"]:
+                    response = client.post(
+                        "/lookup",
+                        json={
+                            "word": word,
+                            "dict_path": "/test/dict.mdx",
+                            "ignorecase": True,
+                        },
+                    )
+                    assert response.status_code == 200
+                    assert response.json()["definitions"] == [
+                        "definition 1",
+                        "definition 2",
+                    ]
+                assert mock_builder.mdx_lookup.call_count == 1
+
+                # Case-sensitive lookups are cached separately
+                client.post(
+                    "/lookup", json={"word": "Test", "dict_path": "/test/dict.mdx"}
+                )
+                assert mock_builder.mdx_lookup.call_count == 2
+
+    def test_lookup_cache_folds_ascii_only(self, client, mock_builder):
+        """Test ignorecase cache keys fold case like SQLite lower(), ASCII only."""
+        main._dict_cache["/test/dict.mdx"] = mock_builder
+        with patch("dict_vocab.api.main.os.path.exists", return_value=True):
+            with patch(
+                "dict_vocab.api.main.get_dict_builder", return_value=mock_builder
+            ):
+                for word in ["Äpfel", "äpfel", "ÄPFEL"]:
+                    client.post(
+                        "/lookup",
+                        json={
+                            "word": word,
+                            "dict_path": "/test/dict.mdx",
+                            "ignorecase": True,
+                        },
+                    )
+                # "ÄPFEL" shares "Äpfel"'s entry, "äpfel" is a different key
+                assert [c.args[0] for c in mock_builder.mdx_lookup.call_args_list] == [
+                    "Äpfel",
+                    "äpfel",
+                ]
+
+    def test_cache_clear(self, client, mock_builder):
+        """Test /cache/clear drops cached lookup results."""
+        with patch("dict_vocab.api.main.os.path.exists", return_value=True):
+            with patch(
+                "dict_vocab.api.main.get_dict_builder", return_value=mock_builder
+            ):
+                body = {"word": "test", "dict_path": "/test/dict.mdx"}
+                client.post("/lookup", json=body)
+                response = client.post("/cache/clear")
+                assert response.status_code == 200
+                client.post("/lookup", json=body)
+                assert mock_builder.mdx_lookup.call_count == 2
+
+
+class TestLRUCache:
+    """Test the bounded LRU cache."""
+
+    def test_evicts_least_recently_used(self):
+        """Test the oldest untouched entry is evicted first."""
+        evicted = []
+        cache = LRUCache(maxsize=2, on_evict=lambda k, v: evicted.append((k, v)))
+        cache["a"] = 1
+        cache["b"] = 2
+        assert cache.get("a") == 1
+        cache["c"] = 3
+
+        assert "b" not in cache
+        assert "a" in cache and "c" in cache
+        assert evicted == [("b", 2)]
+        assert len(cache) == 2
+
+    def test_get_missing_returns_default(self):
+        """Test get returns the default for unknown keys."""
+        cache = LRUCache(maxsize=1)
+        assert cache.get("missing") is None
+        assert cache.get("missing", []) == []
+
+
+class TestLookupStream:
+    """Test streaming lookup endpoint."""
+
+    @pytest.mark.parametrize("definitions", [[], ["one"], ["<b>释义</b>" * 50, "two"]])
+    def test_lookup_stream_matches_lookup(self, client, mock_builder, definitions):
+        """Test the streamed body decodes to the same JSON as /lookup."""
+        mock_builder.mdx_lookup.return_value = definitions
+        body = {"word": "test", "dict_path": "/test/dict.mdx"}
+
+        with patch("dict_vocab.api.main.os.path.exists", return_value=True):
+            with patch(
+                "dict_vocab.api.main.get_dict_builder", return_value=mock_builder
+            ):
+                with patch("dict_vocab.api.main.STREAM_CHUNK_SIZE", 16):
+                    streamed = client.post("/lookup/stream", json=body)
+                regular = client.post("/lookup", json=body)
+
+        assert streamed.status_code == 200
+        assert streamed.headers["content-type"] == "application/json"
+        assert streamed.json() == regular.json()
+        assert streamed.json()["definitions"] == definitions
+
+    def test_lookup_stream_dict_not_found(self, client):
+        """Test streaming lookup reports errors like /lookup."""
+        with patch("dict_vocab.api.main.os.path.exists", return_value=False):
+            response = client.post(
+                "/lookup/stream",
+                json={"word": "test", "dict_path": "/nonexistent/dict.mdx"},
+            )
+            assert response.status_code == 404
+
+
+class TestLookupBatcher:
+    """Test coalescing of concurrent lookups."""
+
+    def test_concurrent_lookups_are_batched(self, mock_builder):
+        """Test concurrent lookups share one mdx_lookup_batch call."""
+        import asyncio
+
+        mock_builder.mdx_lookup_batch.side_effect = lambda words, ignorecase: [
+            [f"definition of {word}"] for word in words
+        ]
+        batcher = LookupBatcher(ignorecase=False)
+
+        async def run():
+            return await asyncio.gather(
+                *(batcher.lookup(mock_builder, word) for word in ["a", "b", "c"])
+            )
+
+        results = asyncio.run(run())
+
+        assert results == [
+            ["definition of a"],
+            ["definition of b"],
+            ["definition of c"],
+        ]
+        mock_builder.mdx_lookup_batch.assert_called_once_with(
+            ["a", "b", "c"], ignorecase=False
+        )
+        mock_builder.mdx_lookup.assert_not_called()
+        # The batcher doesn't hold on to the builder once the batch is sent
+        assert batcher._builder is None
+
+    def test_batch_flushes_when_full(self, mock_builder):
+        """Test a full batch is dispatched without waiting for the timer."""
+        import asyncio
+
+        mock_builder.mdx_lookup_batch.side_effect = lambda words, ignorecase: [
+            [word] for word in words
+        ]
+        batcher = LookupBatcher(ignorecase=True, max_batch=2, max_wait=60)
+
+        async def run():
+            return await asyncio.wait_for(
+                asyncio.gather(
+                    batcher.lookup(mock_builder, "a"), batcher.lookup(mock_builder, "b")
+                ),
+                timeout=5,
+            )
+
+        assert asyncio.run(run()) == [["a"], ["b"]]
+
+    def test_batch_error_reaches_every_caller(self, mock_builder):
+        """Test a failed batch raises in every waiting lookup."""
+        import asyncio
+
+        mock_builder.mdx_lookup_batch.side_effect = RuntimeError("broken index")
+        batcher = LookupBatcher(ignorecase=False)
+
+        async def run():
+            return await asyncio.gather(
+                batcher.lookup(mock_builder, "a"),
+                batcher.lookup(mock_builder, "b"),
+                return_exceptions=True,
+            )
+
+        results = asyncio.run(run())
+        assert all(isinstance(r, RuntimeError) for r in results)
+
+
+class TestTTLCache:
+    """Test the expiring cache."""
+
+    def test_entries_expire(self):
+        """Test entries are dropped once their ttl has passed."""
+        with patch("dict_vocab.api.cache.time.monotonic", return_value=100.0):
+            cache = TTLCache(maxsize=4, ttl=5)
+            cache["path"] = True
+            assert cache.get("path") is True
+
+        with patch("dict_vocab.api.cache.time.monotonic", return_value=105.0):
+            assert cache.get("path") is None
+            assert len(cache) == 0
+
 
 class TestGetDictBuilder:
     """Test get_dict_builder function."""
@@ -156,13 +429,78 @@ class TestGetDictBuilder:
                 builder2 = get_dict_builder("/test/dict.mdx", force_rebuild=False)
                 assert builder1 is builder2
 
-    def test_get_dict_builder_force_rebuild(self, mock_builder):
-        """Test force_rebuild creates new builder."""
-        with patch("dict_vocab.api.main.IndexBuilder", return_value=mock_builder):
+    def test_get_dict_builder_force_rebuild(self):
+        """Test force_rebuild replaces and closes the cached builder."""
+        with patch(
+            "dict_vocab.api.main.IndexBuilder", side_effect=lambda **kw: MagicMock()
+        ) as index_builder:
             with patch("dict_vocab.api.main.os.path.exists", return_value=True):
                 builder1 = get_dict_builder("/test/dict.mdx", force_rebuild=False)
+                main._lookup_cache[("/test/dict.mdx", "word", False)] = ["old"]
+                main._lookup_cache[("/test/other.mdx", "word", False)] = ["other"]
                 builder2 = get_dict_builder("/test/dict.mdx", force_rebuild=True)
+                # Results from the replaced index are not served any more
+                assert main._lookup_cache.keys() == [("/test/other.mdx", "word", False)]
+                builder3 = get_dict_builder("/test/dict.mdx", force_rebuild=False)
                 assert builder1 is not builder2
+                assert builder2 is builder3
+                builder1.close.assert_called_once()
+                assert index_builder.call_args.kwargs["force_rebuild"] is True
+
+    def test_replaced_builder_closed_after_running_batch(self):
+        """Test a rebuild waits for batches on the old builder before closing it."""
+        import asyncio
+        import threading
+
+        started, release = threading.Event(), threading.Event()
+        old, new = MagicMock(), MagicMock()
+
+        def slow_lookup(word, ignorecase=False):
+            started.set()
+            release.wait(5)
+            return ["old definition"]
+
+        old.mdx_lookup.side_effect = slow_lookup
+        builders = iter([old, new])
+        request = main.LookupRequest(word="word", dict_path="/test/dict.mdx")
+
+        async def run():
+            lookup = asyncio.create_task(main._lookup(request))
+            await anyio.to_thread.run_sync(started.wait, 5)
+            assert get_dict_builder("/test/dict.mdx", force_rebuild=True) is new
+            old.close.assert_not_called()
+            release.set()
+            result = await lookup
+            # Let the batch task's done callbacks run
+            for _ in range(3):
+                await asyncio.sleep(0)
+            return result
+
+        with patch(
+            "dict_vocab.api.main.IndexBuilder", side_effect=lambda **kw: next(builders)
+        ):
+            with patch("dict_vocab.api.main.os.path.exists", return_value=True):
+                assert asyncio.run(run()) == (old, ["old definition"])
+
+        old.close.assert_called_once()
+        # Results from the replaced builder don't go back into the cache
+        assert main._lookup_cache.keys() == []
+
+    def test_get_dict_builder_evicts_least_recent(self):
+        """Test builders beyond the cache size are evicted and closed."""
+        with patch(
+            "dict_vocab.api.main.IndexBuilder", side_effect=lambda **kw: MagicMock()
+        ):
+            with patch("dict_vocab.api.main.os.path.exists", return_value=True):
+                first = get_dict_builder("/test/dict0.mdx")
+                main.get_lookup_batcher("/test/dict0.mdx", False)
+                main.get_lookup_batcher("/test/dict1.mdx", False)
+                for i in range(1, main.DICT_CACHE_SIZE + 1):
+                    get_dict_builder(f"/test/dict{i}.mdx")
+                first.close.assert_called_once()
+                # The evicted dictionary's batchers go with it
+                assert list(main._lookup_batchers) == [("/test/dict1.mdx", False)]
+                assert get_dict_builder("/test/dict0.mdx") is not first
 
     def test_get_dict_builder_not_found(self):
         """Test get_dict_builder raises error for missing dict."""
@@ -213,9 +551,152 @@ class TestResourceFiles:
         response = client.get("/resource/nonexistent/file.css")
         assert response.status_code == 404
 
+    @pytest.mark.parametrize(
+        "filename, content_type",
+        [
+            ("word.jpg", "image/jpeg"),
+            ("word.wav", "audio/wav"),
+            ("word.ogg", "audio/ogg"),
+            ("word.m4a", "audio/mp4"),
+        ],
+    )
+    def test_resource_content_type(
+        self, client, tmp_path, monkeypatch, filename, content_type
+    ):
+        """Test resource content type is taken from the suffix table."""
+        dict_dir = tmp_path / "testdict"
+        dict_dir.mkdir()
+        (dict_dir / filename).write_bytes(b"\x00" * 16)
+        monkeypatch.setenv("DEFAULT_DICT_PATH", str(dict_dir / "testdict.mdx"))
+
+        response = client.get(f"/resource/testdict/{filename}")
+        assert response.status_code == 200
+        assert response.headers["content-type"] == content_type
+
+    def test_resource_cache_headers(self, client, tmp_path, monkeypatch):
+        """Test resources carry a weak ETag and a revalidation returns 304."""
+        dict_dir = tmp_path / "testdict"
+        dict_dir.mkdir()
+        css = dict_dir / "testdict.css"
+        css.write_text("body {}")
+        monkeypatch.setenv("DEFAULT_DICT_PATH", str(dict_dir / "testdict.mdx"))
+
+        response = client.get("/resource/testdict/testdict.css")
+        assert response.status_code == 200
+        st = css.stat()
+        etag = f'W/"{st.st_mtime_ns:x}-{st.st_size:x}"'
+        assert response.headers["etag"] == etag
+        assert response.headers["cache-control"] == "public, max-age=86400"
+
+        response = client.get(
+            "/resource/testdict/testdict.css", headers={"If-None-Match": etag}
+        )
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["etag"] == etag
+
+        response = client.get(
+            "/resource/testdict/testdict.css", headers={"If-None-Match": '"other"'}
+        )
+        assert response.status_code == 200
+
+    def test_resource_location_resolved_once(self, client, tmp_path, monkeypatch):
+        """Test the resource directory is resolved once per request, on the loop."""
+        dict_dir = tmp_path / "testdict"
+        (dict_dir / "sub").mkdir(parents=True)
+        (dict_dir / "testdict.css").write_text("body {}")
+        monkeypatch.setenv("DEFAULT_DICT_PATH", str(dict_dir / "testdict.mdx"))
+
+        with patch.object(
+            main, "_resource_location", wraps=main._resource_location
+        ) as location:
+            response = client.get("/resource/testdict/testdict.css")
+        assert response.status_code == 200
+        assert location.call_count == 1
+
+        # Directories are not served
+        assert client.get("/resource/testdict/sub").status_code == 404
+
+    def test_resource_encoded_traversal_blocked(self, client, tmp_path, monkeypatch):
+        """Test encoded ../ segments cannot escape the dictionary directory."""
+        dict_dir = tmp_path / "testdict"
+        dict_dir.mkdir()
+        (tmp_path / "secret.txt").write_text("secret")
+        monkeypatch.setenv("DEFAULT_DICT_PATH", str(dict_dir / "testdict.mdx"))
+
+        response = client.get("/resource/testdict/..%2F..%2Fsecret.txt")
+        assert response.status_code == 404
+        assert "secret" not in response.text
+
     def test_resource_directory_not_configured(self, client):
         """Test resource serving when no resource directory exists."""
         with patch("pathlib.Path.exists", return_value=False):
             response = client.get("/resource/test.css")
             # Should return 404 when no dictionary configured and no fallback
             assert response.status_code in [404, 403]
+
+
+class TestZeroCopyFileResponse:
+    """Test zero-copy file response."""
+
+    @staticmethod
+    def _run(response, scope):
+        messages = []
+
+        async def receive():
+            return {"type": "http.request"}
+
+        async def send(message):
+            if message["type"] == "http.response.zerocopysend":
+                # The file is closed once the response finishes
+                message = dict(message, body=message["file"].read())
+            messages.append(message)
+
+        anyio.run(response, scope, receive, send)
+        return messages
+
+    def test_zerocopysend_used_when_supported(self, tmp_path):
+        """Test the file is handed to the server when the extension exists."""
+        css = tmp_path / "style.css"
+        css.write_bytes(b"body { color: red; }")
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "headers": [],
+            "extensions": {"http.response.zerocopysend": {}},
+        }
+        messages = self._run(
+            ZeroCopyFileResponse(str(css), media_type="text/css"), scope
+        )
+
+        assert messages[0]["type"] == "http.response.start"
+        headers = dict(messages[0]["headers"])
+        assert headers[b"content-length"] == b"20"
+        assert headers[b"content-type"].startswith(b"text/css")
+        assert messages[1]["type"] == "http.response.zerocopysend"
+        assert messages[1]["body"] == b"body { color: red; }"
+        assert messages[1]["more_body"] is False
+
+    def test_fallback_without_extension(self, tmp_path):
+        """Test regular body messages are sent when the server lacks support."""
+        css = tmp_path / "style.css"
+        css.write_bytes(b"body { color: red; }")
+        scope = {"type": "http", "method": "GET", "headers": []}
+        messages = self._run(
+            ZeroCopyFileResponse(str(css), media_type="text/css"), scope
+        )
+
+        body_messages = [m for m in messages if m["type"] == "http.response.body"]
+        assert b"".join(m["body"] for m in body_messages) == b"body { color: red; }"
+
+
+class TestORJSONResponse:
+    """Test the JSON response class used app-wide."""
+
+    def test_render_non_ascii(self):
+        """Test non-ASCII definitions are rendered as raw UTF-8."""
+        content = {"word": "词典", "definitions": ["<b>释义</b>"], "dict_title": None}
+        body = ORJSONResponse(content).body
+
+        assert json.loads(body) == content
+        assert "词典".encode("utf-8") in body
@@ -8,9 +8,14 @@
 """
 
 import os
+import shutil
 import sqlite3
 import json
 import struct
+import threading
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from unittest.mock import MagicMock, PropertyMock
 
@@ -22,13 +27,30 @@ import pytest
 # [tool.pytest.ini_options]
 # pythonpath = ["src"]
 # 然后这样导入：
-from dict_vocab.indexer.mdict_indexer import ExtendedMDX, ExtendedMDD, IndexBuilder
+from dict_vocab.indexer import _index_kernel, mdict_indexer
+from dict_vocab.indexer._index_kernel import (
+    block_table, build_columns, gather_columns, locate_records,
+)
+from dict_vocab.indexer.mdict_indexer import (
+    ExtendedMDX, ExtendedMDD, IndexBuilder, INDEX_FIELDS,
+    _bulk_load, _connect_for_bulk_load, _decode_keys, _read_block_table, _wildcard_to_glob,
+)
 
 
 # ----------------------------------------------------------------------
 # Fixtures
 # ----------------------------------------------------------------------
 
+# 只含一个记录块的 3.0 格式记录块区头部：(块数, 总大小, 压缩大小, 解压大小)
+_ONE_BLOCK_HEADER = struct.Struct(">IQII")
+
+# 测试词典的文件头（只读，各测试共用）
+_FAKE_HEADER = {
+    b"Title": "TestDict".encode("utf-8"),
+    b"Description": "A test dictionary".encode("utf-8"),
+}
+
+
 @pytest.fixture
 def fake_mdx_file(tmp_path: Path) -> Path:
     """构造一个最小可用的 .mdx 文件（头部 + 一个记录块）。
@@ -52,18 +74,10 @@ def fake_mdx_file(tmp_path: Path) -> Path:
         compressed_size = len(block_type + block_data)
         decompressed_size = len(block_data)
 
-        # 写记录块信息（假设版本 >= 3.0 的简单格式）
-        # num_record_blocks = 1
-        f.write(struct.pack(">I", 1))
-        # total_size（随便写）
-        f.write(struct.pack(">Q", 0))
-
-        # compressed_size, decompressed_size
-        f.write(struct.pack(">II", compressed_size, decompressed_size))
-
-        # 写入块数据
-        f.write(block_type)
-        f.write(block_data)
+        # 写记录块信息（假设版本 >= 3.0 的简单格式）和块数据：
+        # num_record_blocks = 1，total_size（随便写），compressed_size, decompressed_size
+        f.write(_ONE_BLOCK_HEADER.pack(1, 0, compressed_size, decompressed_size)
+                + block_type + block_data)
 
     return mdx_path
 
@@ -79,20 +93,81 @@ def fake_mdd_file(tmp_path: Path) -> Path:
         compressed_size = len(block_type + block_data)
         decompressed_size = len(block_data)
 
-        f.write(struct.pack(">I", 1))          # num_record_blocks
-        f.write(struct.pack(">Q", 0))          # total_size
-        f.write(struct.pack(">II", compressed_size, decompressed_size))
-        f.write(block_type)
-        f.write(block_data)
+        f.write(_ONE_BLOCK_HEADER.pack(1, 0, compressed_size, decompressed_size)
+                + block_type + block_data)
 
     return mdd_path
 
 
+# 查询测试共用的索引数据库内容
+_GOLDEN_INDEX_DICTS = [
+    {"key_text": "key1", "file_pos": 0, "compressed_size": 10, "decompressed_size": 20,
+     "record_block_type": 0, "record_start": 0, "record_end": 10, "offset": 0},
+    {"key_text": "key2", "file_pos": 0, "compressed_size": 10, "decompressed_size": 20,
+     "record_block_type": 0, "record_start": 10, "record_end": 20, "offset": 0},
+    {"key_text": "other", "file_pos": 10, "compressed_size": 10, "decompressed_size": 20,
+     "record_block_type": 0, "record_start": 20, "record_end": 30, "offset": 20},
+    {"key_text": "Key3", "file_pos": 10, "compressed_size": 10, "decompressed_size": 20,
+     "record_block_type": 0, "record_start": 30, "record_end": 35, "offset": 20},
+    {"key_text": "k?y", "file_pos": 10, "compressed_size": 10, "decompressed_size": 20,
+     "record_block_type": 0, "record_start": 35, "record_end": 40, "offset": 20},
+]
+
+_GOLDEN_META = {
+    "encoding": "UTF-8",
+    "stylesheet": "{}",
+    "title": "TestDict",
+    "description": "A test dictionary",
+    "version": "1.0",
+}
+
+
+@pytest.fixture(scope="session")
+def _golden_lookup_db(tmp_path_factory, sqlite_fast_pragmas):
+    """整个测试会话只构建一次的索引数据库，返回其路径（只读，测试中使用其副本）。"""
+    db_path = tmp_path_factory.mktemp("golden") / "golden.mdx.db"
+    conn = sqlite_fast_pragmas(sqlite3.connect(str(db_path), isolation_level=None))
+    cursor = conn.cursor()
+    cursor.execute("BEGIN")
+    cursor.execute(
+        "CREATE TABLE MDX_INDEX ("
+        "key_text TEXT NOT NULL,"
+        "file_pos INTEGER,"
+        "compressed_size INTEGER,"
+        "decompressed_size INTEGER,"
+        "record_block_type INTEGER,"
+        "record_start INTEGER,"
+        "record_end INTEGER,"
+        "offset INTEGER"
+        ")"
+    )
+    cursor.execute("CREATE INDEX key_cover ON MDX_INDEX (%s)" % ", ".join(INDEX_FIELDS))
+    cursor.execute("CREATE TABLE META (key TEXT, value TEXT)")
+
+    cursor.executemany(
+        "INSERT INTO MDX_INDEX VALUES (:key_text, :file_pos, :compressed_size, "
+        ":decompressed_size, :record_block_type, :record_start, :record_end, :offset)",
+        _GOLDEN_INDEX_DICTS,
+    )
+    cursor.executemany("INSERT INTO META VALUES (?,?)", list(_GOLDEN_META.items()))
+    cursor.execute("COMMIT")
+    conn.close()
+    return db_path
+
+
+@pytest.fixture
+def lookup_db(_golden_lookup_db, fake_mdx_file):
+    """把共用的索引数据库复制到 fake_mdx_file 对应的位置，每个测试得到一份可写的副本。"""
+    db_path = fake_mdx_file.with_suffix(".mdx.db")
+    shutil.copyfile(_golden_lookup_db, db_path)
+    return db_path
+
+
 # ----------------------------------------------------------------------
 # Tests for ExtendedMDX / ExtendedMDD
 # ----------------------------------------------------------------------
 
-def test_extended_mdx_get_index_basic(mocker):
+def test_extended_mdx_get_index_basic(tmp_path, mocker):
     """ExtendedMDX.get_index 基本路径：返回正确结构的索引和元数据。"""
     # 模拟 MDX 父类
     MockMDX = mocker.MagicMock(name="MDX")
@@ -101,10 +176,7 @@ def test_extended_mdx_get_index_basic(mocker):
     MockMDX._stylesheet = {"1": ("<b>", "</b>")}
     MockMDX._number_format = ">Q"
     MockMDX._number_width = 8
-    MockMDX.header = {
-        b"Title": "TestDict".encode("utf-8"),
-        b"Description": "A test dictionary".encode("utf-8"),
-    }
+    MockMDX.header = _FAKE_HEADER
 
     # 模拟 _key_list：两条记录
     MockMDX._key_list = [
@@ -122,33 +194,23 @@ def test_extended_mdx_get_index_basic(mocker):
 
     MockMDX._decode_block = fake_decode_block
 
-    # 模拟文件对象
-    fake_file = mocker.MagicMock(name="file")
-    fake_file.tell.return_value = 123  # file_pos
-    all_data = struct.pack(">I", 1) + struct.pack(">Q", 0) + struct.pack(">II", 10, 20) + b"\x00\x00\x00\x00data\x00data"
-    offset = [0]
-    def fake_read(n):
-        result = all_data[offset[0]:offset[0]+n]
-        offset[0] += n
-        return result
-    fake_file.read.side_effect = fake_read
-    mock_open = mocker.patch("builtins.open", return_value=fake_file)
+    # 写一个真实的文件（get_index 以内存映射方式读取），记录块紧跟在头部之后（file_pos 为头部长度）
+    mdx_path = tmp_path / "test.mdx"
+    mdx_path.write_bytes(_ONE_BLOCK_HEADER.pack(1, 0, 10, 20) + b"\x00\x00\x00\x00data\x00data")
 
     # 构造 ExtendedMDX 实例
     ext = ExtendedMDX.__new__(ExtendedMDX)
-    ext._fname = "test.mdx"
+    ext._fname = str(mdx_path)
     ext._record_block_offset = 0
     # 复制 mock 的父类属性
-    for k, v in vars(MockMDX).items():
-        if not k.startswith("__"):
-            setattr(ext, k, v)
+    ext.__dict__.update({k: v for k, v in MockMDX.__dict__.items() if not k.startswith("__")})
 
     # 调用 get_index
     result = ext.get_index(check_block=True)
 
     # 验证返回结构
     assert isinstance(result, dict)
-    assert "index_dict_list" in result
+    assert "columns" in result
     assert "meta" in result
 
     meta = result["meta"]
@@ -157,20 +219,26 @@ def test_extended_mdx_get_index_basic(mocker):
     assert meta["description"] == "A test dictionary"
     assert meta["version"] == "1.0"
 
-    # 验证 index_dict_list 的基本字段
-    assert len(result["index_dict_list"]) == 2
-    for item in result["index_dict_list"]:
-        assert "key_text" in item
-        assert "file_pos" in item
-        assert "compressed_size" in item
-        assert "decompressed_size" in item
-        assert "record_block_type" in item
-        assert "record_start" in item
-        assert "record_end" in item
-        assert "offset" in item
-
-
-def test_extended_mdd_get_index_basic(mocker):
+    # 验证各索引列
+    assert len(result["columns"]) == len(INDEX_FIELDS)
+    columns = dict(zip(INDEX_FIELDS, result["columns"]))
+    assert columns["key_text"] == ["key1", "key2"]
+    assert columns["record_start"] == [0, 10]
+    assert columns["record_end"] == [10, 20]
+    assert columns["compressed_size"] == [10, 10]
+    assert columns["decompressed_size"] == [20, 20]
+    assert columns["record_block_type"] == [0, 0]
+    assert columns["offset"] == [0, 0]
+    assert columns["file_pos"] == [_ONE_BLOCK_HEADER.size] * 2
+
+    # 按行排列的旧格式按需生成
+    assert "index_dict_list" not in result
+    assert [item["key_text"] for item in result["index_dict_list"]] == ["key1", "key2"]
+    assert result["index_tuple_list"][1] == (
+        "key2", _ONE_BLOCK_HEADER.size, 10, 20, 0, 10, 20, 0)
+
+
+def test_extended_mdd_get_index_basic(tmp_path, mocker):
     """ExtendedMDD.get_index 基本路径：样式表应为空字符串 JSON。"""
     MockMDD = mocker.MagicMock(name="MDD")
     MockMDD._version = 3.0
@@ -190,29 +258,21 @@ def test_extended_mdd_get_index_basic(mocker):
 
     MockMDD._decode_block = fake_decode_block
 
-    fake_file = mocker.MagicMock(name="file")
-    fake_file.tell.return_value = 456
-    all_data = struct.pack(">I", 1) + struct.pack(">Q", 0) + struct.pack(">II", 10, 20) + b"\x00\x00\x00\x00data\x00data"
-    offset = [0]
-    def fake_read(n):
-        result = all_data[offset[0]:offset[0]+n]
-        offset[0] += n
-        return result
-    fake_file.read.side_effect = fake_read
-    mocker.patch("builtins.open", return_value=fake_file)
+    mdd_path = tmp_path / "test.mdd"
+    mdd_path.write_bytes(_ONE_BLOCK_HEADER.pack(1, 0, 10, 20) + b"\x00\x00\x00\x00data\x00data")
 
     ext = ExtendedMDD.__new__(ExtendedMDD)
-    ext._fname = "test.mdd"
+    ext._fname = str(mdd_path)
     ext._record_block_offset = 0
-    for k, v in vars(MockMDD).items():
-        if not k.startswith("__"):
-            setattr(ext, k, v)
+    ext.__dict__.update({k: v for k, v in MockMDD.__dict__.items() if not k.startswith("__")})
 
     result = ext.get_index(check_block=True)
 
     assert isinstance(result, dict)
-    assert "index_dict_list" in result
+    assert "columns" in result
     assert "meta" in result
+    assert result["columns"][0] == ["res1"]
+    assert result["columns"][1] == [_ONE_BLOCK_HEADER.size]
 
     meta = result["meta"]
     assert meta["encoding"] == "UTF-8"
@@ -220,10 +280,236 @@ def test_extended_mdd_get_index_basic(mocker):
     assert meta["version"] == "1.0"
 
 
+def _write_mdx_blocks(path, blocks, decompressed_sizes, version=3.0):
+    """写出只含记录块区头部、信息表和记录块的数据（3.0 或 2.0 格式），返回路径。"""
+    if version >= 3.0:
+        header = struct.pack(">IQ", len(blocks), 0)
+        size_pair = ">II"
+    else:
+        header = struct.pack(">4Q", len(blocks), 0, 0, 0)
+        size_pair = ">QQ"
+    table = b"".join(struct.pack(size_pair, len(block), decompressed_size)
+                     for block, decompressed_size in zip(blocks, decompressed_sizes))
+    path.write_bytes(header + table + b"".join(blocks))
+    return path
+
+
+def _make_mdx(path, key_list, version=3.0):
+    """构造一个读取 path 的 ExtendedMDX，跳过文件头解析。"""
+    ext = ExtendedMDX.__new__(ExtendedMDX)
+    ext._fname = str(path)
+    ext._record_block_offset = 0
+    ext._version = version
+    ext._encoding = "UTF-8"
+    ext._stylesheet = {}
+    ext._number_format = ">Q"
+    ext._number_width = 8
+    ext.header = {}
+    ext._key_list = key_list
+    return ext
+
+
+def test_extended_mdx_get_index_skips_block_body(tmp_path):
+    """check_block=False 时只读取块类型，跳过块内容且不解压。"""
+    blocks = [b"\x00\x00\x00\x00" + b"a" * 6, b"\x02\x00\x00\x00" + b"b" * 12]
+    mdx_path = _write_mdx_blocks(tmp_path / "two_blocks.mdx", blocks, [6, 8])
+
+    ext = _make_mdx(mdx_path, [(0, b"one"), (6, b"two")])
+    ext._decode_block = MagicMock(side_effect=AssertionError("不应解压"))
+
+    result = ext.get_index(check_block=False)
+
+    columns = dict(zip(INDEX_FIELDS, result["columns"]))
+    assert columns["file_pos"] == [28, 28 + len(blocks[0])]
+    assert columns["record_block_type"] == [0, 2]
+    assert columns["offset"] == [0, 6]
+    assert columns["record_end"] == [6, 14]
+
+
+def test_extended_mdx_get_index_checks_blocks_in_background(tmp_path):
+    """check_block=True 时在线程池中解压校验每个记录块，长度不符则报错。"""
+    blocks = [b"\x00\x00\x00\x00" + b"a" * 6, b"\x00\x00\x00\x00" + b"b" * 8]
+    mdx_path = _write_mdx_blocks(tmp_path / "checked.mdx", blocks, [6, 8])
+
+    ext = _make_mdx(mdx_path, [(0, b"one"), (6, b"two")])
+    ext._decode_block = MagicMock(side_effect=lambda block, size: block[4:])
+
+    result = ext.get_index(check_block=True)
+    assert result["columns"][0] == ["one", "two"]
+    assert [c.args[0] for c in ext._decode_block.call_args_list] == blocks
+
+    ext._decode_block = MagicMock(side_effect=lambda block, size: block)
+    with pytest.raises(AssertionError):
+        ext.get_index(check_block=True)
+
+
+def test_extended_mdx_get_index_v2_header(tmp_path):
+    """2.0 版本的记录块区头部有 4 个数字，信息表按 _number_format 解析。"""
+    blocks = [b"\x00\x00\x00\x00" + b"a" * 6, b"\x00\x00\x00\x00" + b"b" * 8]
+    mdx_path = _write_mdx_blocks(tmp_path / "v2.mdx", blocks, [6, 8], version=2.0)
+
+    ext = _make_mdx(mdx_path, [(0, b"one"), (6, b"two")], version=2.0)
+    result = ext.get_index(check_block=False)
+
+    columns = dict(zip(INDEX_FIELDS, result["columns"]))
+    assert columns["key_text"] == ["one", "two"]
+    assert columns["file_pos"] == [64, 64 + len(blocks[0])]
+    assert columns["record_end"] == [6, 14]
+
+
+def test_extended_mdx_decode_block_skips_key_for_plain_blocks(mocker):
+    """未加密的记录块解压时不计算解密密钥（ripemd128）。"""
+    ext = _make_mdx("unused.mdx", [])
+    ext._encrypted_key = None
+    ripemd128 = mocker.spy(mdict_indexer, "ripemd128")
+
+    data = b"record data" * 8
+    compressed = zlib.compress(data)
+    block = struct.pack("<L", 2) + struct.pack(">I", zlib.adler32(compressed)) + compressed
+    assert ext._decode_block(block, len(data)) == data
+    assert ripemd128.call_count == 0
+
+    # 加密块（加密方式 1）仍以校验值的 ripemd128 作为密钥
+    decrypt = mocker.patch.object(mdict_indexer, "_fast_decrypt", side_effect=lambda d, k: d)
+    block = struct.pack("<L", 0x0412) + block[4:]
+    assert ext._decode_block(block, len(data)) == data
+    assert decrypt.call_args.args == (compressed[:4], ripemd128.spy_return)
+
+
+@pytest.mark.parametrize("check_block", [False, True])
+def test_extended_mdx_get_index_unknown_block_type(tmp_path, check_block):
+    """记录块压缩类型未知时报错。"""
+    block = b"\x03\x00\x00\x00" + b"data"
+    mdx_path = _write_mdx_blocks(tmp_path / "unknown.mdx", [block], [4])
+    ext = _make_mdx(mdx_path, [(0, b"one")])
+
+    with pytest.raises(Exception, match="未知的压缩类型"):
+        ext.get_index(check_block=check_block)
+
+
+@pytest.mark.parametrize("number_format", [">I", ">Q"])
+def test_read_block_table(number_format):
+    """_read_block_table 一次解析全部记录块的大小，文件位置从信息表之后开始累加。"""
+    buf = b"head" + struct.pack(">4" + number_format[-1], 10, 20, 30, 40) + b"rest"
+    table_end = 4 + 4 * struct.calcsize(number_format)
+    assert _read_block_table(buf, 4, 2, number_format) == (
+        [10, 30], [20, 40], [table_end, table_end + 10], [0, 20])
+
+
+def test_decode_keys():
+    """_decode_keys 批量解码词条；词条含分隔符时退回逐条解码。"""
+    key_list = [(0, "apple".encode("utf-8")), (5, "苹果".encode("utf-8"))]
+    assert _decode_keys(key_list) == ["apple", "苹果"]
+    assert _decode_keys([]) == []
+
+    key_list = [(0, b"a\x1fb"), (3, b"c")]
+    assert _decode_keys(key_list) == ["a\x1fb", "c"]
+
+    # 重复词条共用同一个字符串对象
+    decoded = _decode_keys([(0, b"see"), (3, b"other"), (8, b"see")])
+    assert decoded == ["see", "other", "see"]
+    assert decoded[0] is decoded[2]
+
+
 # ----------------------------------------------------------------------
 # Tests for IndexBuilder
 # ----------------------------------------------------------------------
 
+@pytest.mark.parametrize("use_numpy", [False, True])
+def test_locate_records(use_numpy, monkeypatch):
+    """locate_records 把词条分配到记录块，跳过空块，丢弃越界词条。"""
+    if use_numpy and _index_kernel.np is None:
+        pytest.skip("numpy 未安装")
+    if not use_numpy:
+        monkeypatch.setattr(_index_kernel, "np", None)
+
+    # 三个记录块：[0, 10)、空块、[10, 15)
+    block_ix, ends = locate_records([0, 4, 10, 12, 20], [10, 0, 5])
+    assert block_ix == [0, 0, 2, 2]
+    assert ends == [4, 10, 12, 20]
+
+    block_ix, ends = locate_records([0, 3], [8])
+    assert block_ix == [0, 0]
+    assert ends == [3, 8]
+
+    assert locate_records([], [8]) == ([], [])
+
+
+@pytest.mark.parametrize("use_numpy", [False, True])
+def test_block_table(use_numpy, monkeypatch):
+    """block_table 解析记录块大小并累加出各块的文件位置与偏移。"""
+    if use_numpy and _index_kernel.np is None:
+        pytest.skip("numpy 未安装")
+    if not use_numpy:
+        monkeypatch.setattr(_index_kernel, "np", None)
+
+    buf = struct.pack(">6Q", 10, 20, 5, 0, 30, 40)
+    assert block_table(buf, ">Q", 100) == (
+        [10, 5, 30], [20, 0, 40], [100, 110, 115], [0, 20, 20])
+    assert block_table(b"", ">I", 100) == ([], [], [], [])
+
+
+@pytest.mark.parametrize("use_numpy", [False, True])
+def test_gather_columns(use_numpy, monkeypatch):
+    """gather_columns 按词条所在块下标把按块排列的列展开到每个词条。"""
+    if use_numpy and _index_kernel.np is None:
+        pytest.skip("numpy 未安装")
+    if not use_numpy:
+        monkeypatch.setattr(_index_kernel, "np", None)
+
+    assert gather_columns([0, 0, 2], [100, 110, 115], [0, 2, 1]) == [
+        [100, 100, 115], [0, 0, 1]]
+    assert gather_columns([], [100]) == [[]]
+
+
+@pytest.mark.parametrize("use_numpy", [False, True])
+def test_build_columns(use_numpy, monkeypatch):
+    """build_columns 生成除 key_text 外的 7 个索引列，丢弃越界词条。"""
+    if use_numpy and _index_kernel.np is None:
+        pytest.skip("numpy 未安装")
+    if not use_numpy:
+        monkeypatch.setattr(_index_kernel, "np", None)
+
+    block_info = ([10, 5, 30], [10, 0, 5], [100, 110, 115], [0, 10, 10])
+    assert build_columns(block_info, [2, 0, 1], [0, 4, 10, 12, 20]) == (
+        [100, 100, 115, 115], [10, 10, 30, 30], [10, 10, 5, 5], [2, 2, 1, 1],
+        [0, 4, 10, 12], [4, 10, 12, 20], [0, 0, 10, 10])
+    assert build_columns(([], [], [], []), [], []) == ([],) * 7
+
+
+def test_connect_for_bulk_load(tmp_path):
+    """构建索引用的连接应关闭日志与同步写入，并由调用方管理事务。"""
+    conn = _connect_for_bulk_load(str(tmp_path / "bulk.db"))
+    try:
+        assert conn.isolation_level is None
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "off"
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 0
+        assert conn.execute("PRAGMA temp_store").fetchone()[0] == 2
+        assert conn.execute("PRAGMA locking_mode").fetchone()[0] == "exclusive"
+    finally:
+        conn.close()
+
+
+def test_bulk_load_removes_partial_database(tmp_path):
+    """写入出错时关闭连接并删除写了一半的数据库，成功时提交并释放独占锁。"""
+    db_path = tmp_path / "bulk.db"
+    with pytest.raises(sqlite3.IntegrityError):
+        with _bulk_load(str(db_path)) as c:
+            c.execute("CREATE TABLE T (k TEXT NOT NULL)")
+            c.executemany("INSERT INTO T VALUES (?)", iter([("a",), (None,)]))
+    assert not db_path.exists()
+
+    with _bulk_load(str(db_path)) as c:
+        c.execute("CREATE TABLE T (k TEXT NOT NULL)")
+        c.executemany("INSERT INTO T VALUES (?)", iter([("a",), ("b",)]))
+    conn = sqlite3.connect(str(db_path), timeout=0)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        assert conn.execute("SELECT COUNT(*) FROM T").fetchone()[0] == 2
+    finally:
+        conn.close()
+
+
 def test_index_builder_build_mdx_index(tmp_path, fake_mdx_file, mocker):
     """IndexBuilder 能够为 MDX 创建 SQLite 索引并写入元数据。"""
     db_path = fake_mdx_file.with_suffix(".mdx.db")
@@ -233,33 +519,12 @@ def test_index_builder_build_mdx_index(tmp_path, fake_mdx_file, mocker):
     MockExtMDX._version = 3.0
     MockExtMDX._encoding = "UTF-8"
     MockExtMDX._stylesheet = {"1": ("<b>", "</b>")}
-    MockExtMDX.header = {
-        b"Title": "TestDict".encode("utf-8"),
-        b"Description": "A test dictionary".encode("utf-8"),
-    }
+    MockExtMDX.header = _FAKE_HEADER
 
-    index_dict_list = [
-        {
-            "key_text": "key1",
-            "file_pos": 0,
-            "compressed_size": 10,
-            "decompressed_size": 20,
-            "record_block_type": 0,
-            "record_start": 0,
-            "record_end": 10,
-            "offset": 0,
-        },
-        {
-            "key_text": "key2",
-            "file_pos": 0,
-            "compressed_size": 10,
-            "decompressed_size": 20,
-            "record_block_type": 0,
-            "record_start": 10,
-            "record_end": 20,
-            "offset": 0,
-        },
-    ]
+    # 列的顺序见 INDEX_FIELDS
+    columns = (
+        ["key1", "key2"], [0, 0], [10, 10], [20, 20], [0, 0], [0, 10], [10, 20], [0, 0],
+    )
 
     meta = {
         "encoding": "UTF-8",
@@ -270,7 +535,7 @@ def test_index_builder_build_mdx_index(tmp_path, fake_mdx_file, mocker):
     }
 
     MockExtMDX.get_index.return_value = {
-        "index_dict_list": index_dict_list,
+        "columns": columns,
         "meta": meta,
     }
 
@@ -294,22 +559,25 @@ def test_index_builder_build_mdx_index(tmp_path, fake_mdx_file, mocker):
     conn = sqlite3.connect(str(db_path))
     cursor = conn.cursor()
 
-    # 表存在
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='MDX_INDEX'")
-    assert cursor.fetchone() is not None
+    # 表和索引存在（一次查询 sqlite_master）
+    rows = cursor.execute("SELECT type, name, tbl_name FROM sqlite_master").fetchall()
+    tables = {name for type_, name, _ in rows if type_ == "table"}
+    indexes = {name for type_, name, tbl_name in rows
+               if type_ == "index" and tbl_name == "MDX_INDEX"}
+    assert {"MDX_INDEX", "META"} <= tables
+    assert "key_cover" in indexes
 
-    # META 表存在
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='META'")
-    assert cursor.fetchone() is not None
+    # 建立索引后收集了统计信息
+    cursor.execute("SELECT idx FROM sqlite_stat1 WHERE tbl='MDX_INDEX'")
+    assert "key_cover" in [row[0] for row in cursor.fetchall()]
 
-    # 索引存在
-    cursor.execute("PRAGMA index_list('MDX_INDEX')")
-    indexes = [row[1] for row in cursor.fetchall()]
-    assert any("key_index" in name for name in indexes)
+    # 按词条查询只读覆盖索引，不回表
+    cursor.execute("EXPLAIN QUERY PLAN SELECT * FROM MDX_INDEX WHERE key_text = 'key1'")
+    assert "USING COVERING INDEX key_cover" in str(cursor.fetchall())
 
     # 验证数据条数
     cursor.execute("SELECT COUNT(*) FROM MDX_INDEX")
-    assert cursor.fetchone()[0] == len(index_dict_list)
+    assert cursor.fetchone()[0] == len(columns[0])
 
     # 验证元数据
     cursor.execute("SELECT key, value FROM META")
@@ -319,73 +587,95 @@ def test_index_builder_build_mdx_index(tmp_path, fake_mdx_file, mocker):
     assert meta_from_db["description"] == meta["description"]
     assert meta_from_db["version"] == meta["version"]
 
+    # 构建连接关闭后独占锁已释放，其他连接可以获取写锁
+    cursor.execute("BEGIN IMMEDIATE")
+    cursor.execute("ROLLBACK")
+
     conn.close()
 
+    # 样式表在首次使用时才解析
+    assert "_stylesheet" not in vars(builder)
+    assert builder._stylesheet == {"1": ["<b>", "</b>"]}
+    builder.close()
 
-def test_index_builder_mdx_lookup(tmp_path, fake_mdx_file, mocker):
-    """IndexBuilder.mdx_lookup 能够根据索引返回查询结果。"""
-    db_path = fake_mdx_file.with_suffix(".mdx.db")
 
-    # 预先写好一个索引数据库
-    conn = sqlite3.connect(str(db_path))
-    cursor = conn.cursor()
-    cursor.execute(
-        "CREATE TABLE MDX_INDEX ("
-        "key_text TEXT NOT NULL,"
-        "file_pos INTEGER,"
-        "compressed_size INTEGER,"
-        "decompressed_size INTEGER,"
-        "record_block_type INTEGER,"
-        "record_start INTEGER,"
-        "record_end INTEGER,"
-        "offset INTEGER"
-        ")"
-    )
-    cursor.execute(
-        "CREATE TABLE META (key TEXT, value TEXT)"
-    )
+def test_index_builder_packed_index(tmp_path, fake_mdx_file, mocker):
+    """packed_index=True 时同时写出紧凑索引，区分大小写的查询改用它。"""
+    pytest.importorskip("numpy")
+    pytest.importorskip("marisa_trie")
 
-    index_dict_list = [
-        {
-            "key_text": "key1",
-            "file_pos": 0,
-            "compressed_size": 10,
-            "decompressed_size": 20,
-            "record_block_type": 0,
-            "record_start": 0,
-            "record_end": 10,
-            "offset": 0,
-        },
-    ]
+    MockExtMDX = mocker.MagicMock(name="ExtendedMDX")
+    MockExtMDX.get_index.return_value = {
+        "columns": (
+            ["key1", "key2", "key2"], [0, 0, 0], [10, 10, 10], [20, 20, 20],
+            [0, 0, 0], [0, 10, 15], [10, 15, 20], [0, 0, 0],
+        ),
+        "meta": {"encoding": "UTF-8", "stylesheet": "{}", "title": "TestDict",
+                 "description": "", "version": "1.0"},
+    }
+    mocker.patch("dict_vocab.indexer.mdict_indexer.ExtendedMDX", return_value=MockExtMDX)
 
-    tuples = [
-        (
-            item["key_text"],
-            item["file_pos"],
-            item["compressed_size"],
-            item["decompressed_size"],
-            item["record_block_type"],
-            item["record_start"],
-            item["record_end"],
-            item["offset"],
-        )
-        for item in index_dict_list
-    ]
-    cursor.executemany("INSERT INTO MDX_INDEX VALUES (?,?,?,?,?,?,?,?)", tuples)
+    builder = IndexBuilder(fname=str(fake_mdx_file), force_rebuild=True,
+                           packed_index=True)
+    base = str(fake_mdx_file.with_suffix(".mdx.idx"))
+    assert os.path.exists(base + ".npy")
+    assert os.path.exists(base + ".trie")
 
-    meta = {
-        "encoding": "UTF-8",
-        "stylesheet": "{}",
-        "title": "TestDict",
-        "description": "A test dictionary",
-        "version": "1.0",
-    }
-    cursor.executemany(
-        "INSERT INTO META VALUES (?,?)",
-        [(k, v) for k, v in meta.items()],
+    builder._extract_data = lambda mdict_obj, index: (
+        "%d-%d" % (index["record_start"], index["record_end"])).encode("utf-8")
+    lookup_indexes = mocker.spy(builder, "_lookup_indexes")
+
+    assert builder.mdx_lookup("key2") == ["10-15", "15-20"]
+    assert builder.mdx_lookup("missing") == []
+    assert builder.mdx_lookup_batch(["key1", "key2"]) == [["0-10"], ["10-15", "15-20"]]
+    assert lookup_indexes.call_count == 0
+
+    # 忽略大小写仍然走 SQLite
+    assert builder.mdx_lookup("KEY1", ignorecase=True) == ["0-10"]
+    assert lookup_indexes.call_count == 1
+    builder.close()
+
+    # 不启用紧凑索引重建数据库时，旧的紧凑索引被删除，不会与新数据库混用
+    IndexBuilder(fname=str(fake_mdx_file), force_rebuild=True).close()
+    assert not os.path.exists(base + ".npy")
+    assert not os.path.exists(base + ".trie")
+
+
+def _bare_builder(db_path, **overrides):
+    """跳过 __init__ 构造只读 db_path 索引的 IndexBuilder，overrides 覆盖默认属性。"""
+    db_path = str(db_path)
+    builder = IndexBuilder.__new__(IndexBuilder)
+    builder.__dict__.update(
+        _mdx_file=db_path[: -len(".db")],
+        _mdx_db=db_path,
+        _mdd_file=None,
+        _mdd_db=None,
+        _mdx_obj=None,
+        _mdd_obj=None,
+        _encoding="UTF-8",
+        _stylesheet={},
+        _title="",
+        _description="",
+        _passcode=None,
+        _sql_index=True,
+        _check=False,
+        _packed_index=False,
+        _packed=None,
+        _conns={},
+        _conn_lock=threading.Lock(),
+        _block_cache=OrderedDict(),
+        _block_lock=threading.Lock(),
+        _mmaps={},
+        _mmap_lock=threading.Lock(),
     )
-    conn.commit()
-    conn.close()
+    builder.__dict__.update(overrides)
+    return builder
+
+
+def test_index_builder_mdx_lookup(fake_mdx_file, lookup_db, mocker):
+    """IndexBuilder.mdx_lookup 能够根据索引返回查询结果。"""
+    db_path = lookup_db
+    meta = _GOLDEN_META
 
     # 模拟 _extract_data，返回固定文本
     def fake_extract_data(mdict_obj, index):
@@ -396,23 +686,16 @@ def test_index_builder_mdx_lookup(tmp_path, fake_mdx_file, mocker):
     MockExtMDX._fname = str(fake_mdx_file)
     MockExtMDX._encoding = "UTF-8"
 
-    builder = IndexBuilder.__new__(IndexBuilder)
-    builder._mdx_file = str(fake_mdx_file)
-    builder._mdx_db = str(db_path)
-    builder._mdd_file = None
-    builder._mdd_db = None
-    builder._mdx_obj = MockExtMDX
-    builder._mdd_obj = None
-    builder._encoding = meta["encoding"]
-    builder._stylesheet = json.loads(meta["stylesheet"])
-    builder._title = meta["title"]
-    builder._description = meta["description"]
-    builder._passcode = None
-    builder._sql_index = True
-    builder._check = False
-
-    # 替换 _extract_data
-    builder._extract_data = fake_extract_data
+    builder = _bare_builder(
+        db_path,
+        _mdx_obj=MockExtMDX,
+        _encoding=meta["encoding"],
+        _stylesheet=json.loads(meta["stylesheet"]),
+        _title=meta["title"],
+        _description=meta["description"],
+        # 替换 _extract_data
+        _extract_data=fake_extract_data,
+    )
 
     # 查询存在的 key
     results = builder.mdx_lookup("key1", ignorecase=False)
@@ -422,45 +705,162 @@ def test_index_builder_mdx_lookup(tmp_path, fake_mdx_file, mocker):
     # 查询不存在的 key
     empty_results = builder.mdx_lookup("not_exist", ignorecase=False)
     assert empty_results == []
+    builder.close()
 
 
-def test_index_builder_get_mdx_keys(tmp_path, fake_mdx_file, mocker):
-    """IndexBuilder.get_mdx_keys 能够返回所有键，并支持通配符查询。"""
+def test_index_builder_read_definitions_survives_close(tmp_path):
+    """提取过程中另一线程调用 close()，本次调用仍使用开始时的 MDX 实例。"""
+    mdx_obj = object()
+    used = []
+
+    def fake_extract_data(mdict_obj, index):
+        used.append(mdict_obj)
+        builder.close()
+        return b"text"
+
+    builder = _bare_builder(tmp_path / "test.mdx.db", _mdx_obj=mdx_obj,
+                            _extract_data=fake_extract_data)
+    assert builder._read_definitions([{}, {}]) == ["text", "text"]
+    assert used == [mdx_obj, mdx_obj]
+
+
+def test_index_builder_mdx_lookup_batch(tmp_path, fake_mdx_file, sqlite_fast_pragmas, mocker):
+    """IndexBuilder.mdx_lookup_batch 返回与输入关键词一一对应的结果。"""
     db_path = fake_mdx_file.with_suffix(".mdx.db")
 
-    # 预先写好一个索引数据库
-    conn = sqlite3.connect(str(db_path))
+    conn = sqlite_fast_pragmas(sqlite3.connect(str(db_path), isolation_level=None))
     cursor = conn.cursor()
+    cursor.execute("BEGIN")
     cursor.execute(
-        "CREATE TABLE MDX_INDEX (key_text TEXT NOT NULL)"
+        "CREATE TABLE MDX_INDEX ("
+        "key_text TEXT NOT NULL,"
+        "file_pos INTEGER,"
+        "compressed_size INTEGER,"
+        "decompressed_size INTEGER,"
+        "record_block_type INTEGER,"
+        "record_start INTEGER,"
+        "record_end INTEGER,"
+        "offset INTEGER"
+        ")"
+    )
+    cursor.executemany(
+        "INSERT INTO MDX_INDEX VALUES (?,?,?,?,?,?,?,?)",
+        [
+            ("key1", 30, 10, 20, 0, 0, 10, 0),
+            ("key2", 0, 10, 20, 0, 10, 20, 0),
+        ],
     )
-    keys = ["key1", "key2", "other"]
-    cursor.executemany("INSERT INTO MDX_INDEX VALUES (?)", [(k,) for k in keys])
-    conn.commit()
+    cursor.execute("COMMIT")
     conn.close()
 
+    extracted = []
+
+    def fake_extract_data(mdict_obj, index):
+        extracted.append(index["file_pos"])
+        return ("definition at %d" % index["record_start"]).encode("utf-8")
+
+    builder = _bare_builder(
+        db_path, _mdx_obj=object(), _extract_data=fake_extract_data
+    )
+
+    batch_sql = mocker.spy(mdict_indexer, "_batch_lookup_sql")
+    results = builder.mdx_lookup_batch(["key2", "not_exist", "KEY1"])
+    assert results == [["definition at 10"], [], []]
+    # 参数个数补齐到 2 的幂，补齐的重复关键词不产生重复结果
+    assert batch_sql.call_args.args == ("key_text", 4)
+
+    results = builder.mdx_lookup_batch(["KEY1"], ignorecase=True)
+    assert results == [["definition at 0"]]
+
+    # 重复关键词只提取一次，且按 file_pos 顺序提取
+    extracted.clear()
+    results = builder.mdx_lookup_batch(["key1", "key2", "key1"])
+    assert results == [["definition at 0"], ["definition at 10"], ["definition at 0"]]
+    assert extracted == [0, 30]
+
+    # 查询复用同一个持久连接（只读、内存映射），close() 后释放
+    conn = builder._conns[str(db_path)]
+    assert conn.execute("PRAGMA query_only").fetchone()[0] == 1
+    assert conn.execute("PRAGMA mmap_size").fetchone()[0] == 1073741824
+    builder.mdx_lookup("key1")
+    assert builder._conns == {str(db_path): conn}
+    builder.close()
+    assert builder._conns == {}
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute("SELECT 1")
+
+
+def test_index_builder_extract_data_caches_blocks(tmp_path, mocker):
+    """_extract_data 缓存解压后的记录块，同一块内的词条只读取并解压一次。"""
+    mdx_path = tmp_path / "blocks.mdx"
+    mdx_path.write_bytes(b"\x00\x00\x00\x00" + b"firstsecond")
+
+    mdict_obj = MagicMock(name="ExtendedMDX")
+    mdict_obj._fname = str(mdx_path)
+    mdict_obj._decode_block.side_effect = lambda block, size: block[4:]
+
+    builder = IndexBuilder.__new__(IndexBuilder)
+    builder._block_cache = OrderedDict()
+    builder._block_lock = threading.Lock()
+    builder._mmaps = {}
+    builder._mmap_lock = threading.Lock()
+    mocker.patch("dict_vocab.indexer.mdict_indexer.BLOCK_CACHE_SIZE", 1)
+
+    index = {"file_pos": 0, "compressed_size": 15, "decompressed_size": 11,
+             "record_start": 100, "record_end": 105, "offset": 100}
+    assert builder._extract_data(mdict_obj, index) == b"first"
+    index = dict(index, record_start=105, record_end=111)
+    assert builder._extract_data(mdict_obj, index) == b"second"
+    assert mdict_obj._decode_block.call_count == 1
+
+    # 超出容量时淘汰最久未使用的块
+    other = dict(index, file_pos=5, compressed_size=10, decompressed_size=6,
+                 record_start=0, record_end=3, offset=0)
+    assert builder._extract_data(mdict_obj, other) == b"sec"
+    assert list(builder._block_cache) == [(str(mdx_path), 5)]
+    assert mdict_obj._decode_block.call_count == 2
+
+    # 同一文件只建立一次内存映射，close() 时释放
+    mm = builder._mmaps[str(mdx_path)]
+    assert list(builder._mmaps) == [str(mdx_path)]
+    builder._conns = {}
+    builder._conn_lock = threading.Lock()
+    builder.close()
+    assert builder._mmaps == {}
+    assert mm.closed
+
+
+def test_index_builder_replace_stylesheet():
+    """_replace_stylesheet 用样式表包裹标记后的文本，行尾换行规范为 \\r\\n。"""
     builder = IndexBuilder.__new__(IndexBuilder)
-    builder._mdx_file = str(fake_mdx_file)
-    builder._mdx_db = str(db_path)
-    builder._mdd_file = None
-    builder._mdd_db = None
-    builder._mdx_obj = None
-    builder._mdd_obj = None
-    builder._encoding = "UTF-8"
-    builder._stylesheet = {}
-    builder._title = "Test"
-    builder._description = ""
-    builder._passcode = None
-    builder._sql_index = True
-    builder._check = False
+    builder._stylesheet = {"1": ("<b>", "</b>"), "2": ("<i>", "</i>")}
+
+    text = "head`1`bold`2`italic  \n`3`plain`x`"
+    assert builder._replace_stylesheet(text) == (
+        "head<b>bold</b><i>italic</i>\r\nplain`x`"
+    )
+    assert builder._replace_stylesheet("no styles") == "no styles"
+
+
+def test_index_builder_get_mdx_keys(fake_mdx_file, lookup_db, mocker):
+    """IndexBuilder.get_mdx_keys 能够返回所有键，并支持通配符查询。"""
+    db_path = lookup_db
+    keys = [item["key_text"] for item in _GOLDEN_INDEX_DICTS]
+
+    builder = _bare_builder(db_path)
 
     # 获取所有键
     all_keys = builder.get_mdx_keys()
     assert set(all_keys) == set(keys)
 
-    # 通配符查询
+    # 通配符查询（区分大小写，按键排序）
     some_keys = builder.get_mdx_keys(pattern="key*")
-    assert set(some_keys) == {"key1", "key2"}
+    assert some_keys == ["key1", "key2"]
+
+    # 只有 * 是通配符
+    assert builder.get_mdx_keys(pattern="k?y") == ["k?y"]
+    builder.close()
+    assert _wildcard_to_glob("[a]?*") == "[[]a][?]*"
 
 
 # ----------------------------------------------------------------------
@@ -482,7 +882,7 @@ def test_index_builder_with_mdd(tmp_path, fake_mdx_file, fake_mdd_file, mocker):
         b"Description": "".encode("utf-8"),
     }
     MockExtMDX.get_index.return_value = {
-        "index_dict_list": [],
+        "columns": ([],) * len(INDEX_FIELDS),
         "meta": {
             "encoding": "UTF-8",
             "stylesheet": "{}",
@@ -501,7 +901,7 @@ def test_index_builder_with_mdd(tmp_path, fake_mdx_file, fake_mdd_file, mocker):
         b"Description": "".encode("utf-8"),
     }
     MockExtMDD.get_index.return_value = {
-        "index_dict_list": [],
+        "columns": ([],) * len(INDEX_FIELDS),
         "meta": {
             "encoding": "UTF-8",
             "stylesheet": "{}",
@@ -513,6 +913,7 @@ def test_index_builder_with_mdd(tmp_path, fake_mdx_file, fake_mdd_file, mocker):
 
     mocker.patch("dict_vocab.indexer.mdict_indexer.ExtendedMDX", return_value=MockExtMDX)
     mocker.patch("dict_vocab.indexer.mdict_indexer.ExtendedMDD", return_value=MockExtMDD)
+    pool_cls = mocker.patch.object(mdict_indexer, "ThreadPoolExecutor", wraps=ThreadPoolExecutor)
 
     builder = IndexBuilder(
         fname=str(fake_mdx_file),
@@ -526,10 +927,13 @@ def test_index_builder_with_mdd(tmp_path, fake_mdx_file, fake_mdd_file, mocker):
     # 验证两个数据库都被创建
     assert mdx_db_path.exists()
     assert mdd_db_path.exists()
+    # 两个索引在线程池中并行构建
+    pool_cls.assert_called_once_with(max_workers=2)
 
     # 验证 MDD 索引表结构
     conn = sqlite3.connect(str(mdd_db_path))
     cursor = conn.cursor()
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='MDX_INDEX'")
-    assert cursor.fetchone() is not None
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='MDX_INDEX'")
+    assert "WITHOUT ROWID" in cursor.fetchone()[0]
     conn.close()
+    builder.close()
@@ -22,7 +22,7 @@ MDX_FILE = RESOURCE_DIR / "cobuild2024.mdx"
 MDD_FILE = RESOURCE_DIR / "cobuild2024.mdd"
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def mdx_file():
     """Return path to MDX file."""
     if not MDX_FILE.exists():
@@ -30,7 +30,7 @@ def mdx_file():
     return MDX_FILE
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def mdd_file():
     """Return path to MDD file."""
     if not MDD_FILE.exists():
@@ -38,15 +38,31 @@ def mdd_file():
     return MDD_FILE
 
 
-@pytest.fixture
-def index_builder(mdx_file, tmp_path):
-    """Create IndexBuilder with force rebuild."""
-    db_path = mdx_file.with_suffix(".mdx.db")
-    if db_path.exists():
-        db_path.unlink()
-    
+def _link_into(directory, *paths):
+    """Link dictionary files into directory so their index DBs are built there.
+
+    Falls back to a hardlink where symlinks need extra privileges (Windows), and
+    skips when neither kind of link can be created.
+    """
+    for path in paths:
+        link = directory / path.name
+        try:
+            link.symlink_to(path)
+        except OSError:
+            try:
+                os.link(path, link)
+            except OSError as exc:
+                pytest.skip(f"Cannot link {path} into {directory}: {exc}")
+    return directory / paths[0].name
+
+
+@pytest.fixture(scope="session")
+def index_builder(mdx_file, tmp_path_factory):
+    """Build the MDX (and MDD, if present) index once per session in a temporary directory."""
+    paths = [mdx_file] + ([MDD_FILE] if MDD_FILE.exists() else [])
+    mdx_link = _link_into(tmp_path_factory.mktemp("idx"), *paths)
     builder = IndexBuilder(
-        fname=str(mdx_file),
+        fname=str(mdx_link),
         encoding="",
         passcode=None,
         force_rebuild=True,
@@ -54,28 +70,15 @@ def index_builder(mdx_file, tmp_path):
         check=False,
     )
     yield builder
-    
-    if db_path.exists():
-        db_path.unlink()
+    builder.close()
 
 
 class TestIndexBuilderWithRealDict:
     """Test IndexBuilder with real dictionary files."""
 
-    def test_build_mdx_index(self, mdx_file):
+    def test_build_mdx_index(self, index_builder):
         """Test building MDX index with SQLite."""
-        db_path = mdx_file.with_suffix(".mdx.db")
-        
-        if db_path.exists():
-            db_path.unlink()
-        
-        builder = IndexBuilder(
-            fname=str(mdx_file),
-            force_rebuild=True,
-            sql_index=True,
-            check=False,
-        )
-        
+        db_path = Path(index_builder._mdx_db)
         assert db_path.exists(), "SQLite database should be created"
         
         conn = sqlite3.connect(str(db_path))
@@ -96,9 +99,6 @@ class TestIndexBuilderWithRealDict:
         assert "title" in meta
         
         conn.close()
-        
-        if db_path.exists():
-            db_path.unlink()
 
     def test_mdx_lookup(self, index_builder):
         """Test looking up words in MDX."""
@@ -122,29 +122,16 @@ class TestIndexBuilderWithRealDict:
         assert isinstance(keys, list)
         assert len(keys) > 0
 
-    def test_mdd_index(self, mdd_file):
+    def test_mdd_index(self, index_builder, mdd_file):
         """Test building MDD index."""
-        db_path = mdd_file.with_suffix(".mdd.db")
-        
-        if db_path.exists():
-            db_path.unlink()
-        
-        builder = IndexBuilder(
-            fname=str(mdd_file.with_suffix(".mdx")),
-            force_rebuild=True,
-            sql_index=True,
-            check=False,
-        )
-        
-        if db_path.exists():
-            conn = sqlite3.connect(str(db_path))
-            cursor = conn.cursor()
-            cursor.execute("SELECT COUNT(*) FROM MDX_INDEX")
-            count = cursor.fetchone()[0]
-            conn.close()
-            
-            if db_path.exists():
-                db_path.unlink()
+        db_path = Path(index_builder._mdx_db).parent / mdd_file.with_suffix(".mdd.db").name
+        assert db_path.exists()
+        conn = sqlite3.connect(str(db_path))
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM MDX_INDEX")
+        count = cursor.fetchone()[0]
+        conn.close()
+        assert count > 0
 
 
 class TestExtendedMDX:
@@ -155,9 +142,10 @@ class TestExtendedMDX:
         mdx = ExtendedMDX(str(mdx_file))
         result = mdx.get_index(check_block=False)
         
-        assert "index_dict_list" in result
+        assert "columns" in result
         assert "meta" in result
-        assert len(result["index_dict_list"]) > 0
+        assert len(result["columns"][0]) > 0
+        assert len({len(column) for column in result["columns"]}) == 1
         
         meta = result["meta"]
         assert "encoding" in meta
@@ -193,4 +181,4 @@ class TestSQLiteOptimization:
         conn.close()
         
         plan_text = str(plan)
-        assert "INDEX" in plan_text or "key_index" in plan_text, "Query should use index"
+        assert "USING COVERING INDEX key_cover" in plan_text, "Query should use covering index"